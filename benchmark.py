@@ -0,0 +1,416 @@
+"""
+Load benchmark for chat server
+
+Starts server.py in a subprocess and drives it with simulated asyncio clients:
+    - connect: a lot of idle connections (connected, but not registered), memory per connection
+    - registration: many clients register at the same time
+    - broadcast: senders send public messages, they are delivered to all registered clients
+    - private: senders send private messages to their peers
+    - games: players play rock-paper-scissors with server
+Every scenario reports throughput, p50/p99 end-to-end latency and CPU usage of server processes.
+Memory and CPU are read from /proc, so they are reported only on Linux.
+
+Start:
+    python benchmark.py                                 - 10000 idle and 1000 registered clients, 10 senders
+    python benchmark.py --idle 1000 --clients 200       - custom load
+    python benchmark.py --server /path/to/server.py     - benchmark another version of server
+    python benchmark.py --workers 1,2,4                 - compare throughput of multi-process server (see cluster.py)
+    python benchmark.py --json new.json --compare old.json  - save results and compare them with previous ones
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+import common
+
+HOST = "127.0.0.1"
+PORT = 8890
+CONCURRENT_CONNECTS = 100  # max count of connections that are opened at the same time
+TIMEOUT = 10  # seconds, max time of waiting for one response
+PUBLIC_MSG_PATTERN = re.compile(r"public (\d+) ([\d.]+)")  # sender number and perf_counter time of sending
+PRIVATE_MSG_PATTERN = re.compile(r"private (\d+) ([\d.]+)")
+
+
+def start_server(server_path: str, port: int, workers: int = 1) -> subprocess.Popen:
+    """
+    Run server with {workers} processes in subprocess and wait until it accepts connections
+    """
+    # pylint: disable=R1732     # process is stopped by caller
+    process = subprocess.Popen([sys.executable, os.path.basename(server_path), HOST, str(port)],
+                               cwd=os.path.dirname(os.path.abspath(server_path)),
+                               env=dict(os.environ, CHAT_WORKERS=str(workers)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection((HOST, port), timeout=1).close()
+            time.sleep(0.5 if workers > 1 else 0)   # the first worker is ready, wait for others
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Server was not started")
+
+
+def process_tree(pid: int) -> List[int]:
+    """
+    Server process and its worker processes
+    """
+    pids = [pid]
+    try:
+        with open("/proc/{0}/task/{0}/children".format(pid), encoding="utf-8") as children:
+            pids += [int(child) for child in children.read().split()]
+    except OSError:
+        pass
+    return pids
+
+
+def resource_usage(pid: int) -> Dict[str, float]:
+    """
+    Resident memory (bytes) and CPU time (seconds) of server processes, zeros if /proc is not available
+    """
+    rss = cpu = 0.0
+    ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+    for process_id in process_tree(pid):
+        try:
+            with open("/proc/{}/stat".format(process_id), encoding="utf-8") as stat:
+                fields = stat.read().rsplit(")", 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / ticks     # utime + stime
+            rss += int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            pass
+    return {"rss": rss, "cpu": cpu}
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """
+    Nearest-rank percentile of {values} in milliseconds
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return round(values[min(int(len(values) * percent / 100), len(values) - 1)] * 1000, 3)
+
+
+def latency_stats(latencies: List[float]) -> dict:
+    """
+    p50/p99/max of latencies in milliseconds
+    """
+    return {"p50_ms": percentile(latencies, 50), "p99_ms": percentile(latencies, 99),
+            "max_ms": percentile(latencies, 100)}
+
+
+class Client:
+    """
+    Simulated chat client.
+    Incoming frames are parsed and put to queue if client takes part in scenarios, otherwise they are dropped.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, parse: bool):
+        self.reader = reader
+        self.writer = writer
+        self.frames: asyncio.Queue = asyncio.Queue()
+        self.task = asyncio.ensure_future(self.read_frames() if parse else self.drain())
+
+    async def read_frames(self):
+        """
+        Put incoming frames to queue
+        """
+        try:
+            while True:
+                header = await self.reader.readexactly(common.FRAME_HEADER.size)
+                (size,) = common.FRAME_HEADER.unpack(header)
+                self.frames.put_nowait((await self.reader.readexactly(size)).decode())
+        except (asyncio.IncompleteReadError, OSError):
+            pass
+
+    async def drain(self):
+        """
+        Read and drop incoming data, so server never waits for a slow reader
+        """
+        try:
+            while await self.reader.read(65536):
+                pass
+        except OSError:
+            pass
+
+    async def expect(self, predicate: Callable[[str], bool]) -> str:
+        """
+        Wait for frame that matches {predicate}, other frames are skipped
+        """
+        while True:
+            msg = await asyncio.wait_for(self.frames.get(), TIMEOUT)
+            if predicate(msg):
+                return msg
+
+    def send(self, msg: str):
+        """
+        Send message without waiting
+        """
+        self.writer.write(common.encode_frame(msg))
+
+    def close(self):
+        """
+        Stop reading and close connection
+        """
+        self.task.cancel()
+        self.writer.close()
+
+
+async def open_idle_connections(port: int, count: int) -> list:
+    """
+    Open {count} connections that never register, returns list of stream writers
+    """
+    writers = []
+    for _ in range(count):
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(HOST, port), 5)
+        except (OSError, asyncio.TimeoutError):
+            break
+        writers.append(writer)
+    return writers
+
+
+async def register(port: int, name: str, parse: bool, semaphore: asyncio.Semaphore, latencies: List[float]) -> Client:
+    """
+    Open connection and register user with {name}, registration latency is added to {latencies}
+    """
+    async with semaphore:
+        start = time.perf_counter()
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(HOST, port), TIMEOUT)
+        client = Client(reader, writer, parse=True)
+        client.send(name)
+        await client.expect(lambda msg: "Welcome" in msg)
+        latencies.append(time.perf_counter() - start)
+    if not parse:
+        client.task.cancel()
+        client.task = asyncio.ensure_future(client.drain())
+    return client
+
+
+async def broadcast(listener: Client, senders: List[Client], messages: int) -> List[float]:
+    """
+    Senders send public messages one by one, every next message is sent after delivery of the previous one
+    to listener. Returns delivery latencies.
+    """
+    delivered = [asyncio.Event() for _ in senders]
+    latencies: List[float] = []
+
+    async def listen():
+        while True:
+            msg = await listener.frames.get()
+            for sender, sent_at in PUBLIC_MSG_PATTERN.findall(msg):
+                latencies.append(time.perf_counter() - float(sent_at))
+                delivered[int(sender)].set()
+
+    async def send(number: int, sender: Client):
+        for _ in range(messages):
+            delivered[number].clear()
+            sender.send("public {} {}".format(number, time.perf_counter()))
+            await asyncio.wait_for(delivered[number].wait(), TIMEOUT)
+
+    listen_task = asyncio.ensure_future(listen())
+    try:
+        await asyncio.gather(*[send(number, sender) for number, sender in enumerate(senders)])
+    finally:
+        listen_task.cancel()
+    return latencies
+
+
+async def private_messages(senders: List[Client], peers: List[Client], peer_names: List[str],
+                           messages: int) -> List[float]:
+    """
+    Every sender sends private messages to its peer one by one, returns delivery latencies
+    """
+    latencies: List[float] = []
+
+    async def send(number: int):
+        for _ in range(messages):
+            senders[number].send("[{}] private {} {}".format(peer_names[number], number, time.perf_counter()))
+            msg = await peers[number].expect(PRIVATE_MSG_PATTERN.search)
+            latencies.append(time.perf_counter() - float(PRIVATE_MSG_PATTERN.search(msg).group(2)))
+
+    await asyncio.gather(*[send(number) for number in range(len(senders))])
+    return latencies
+
+
+async def play_games(players: List[Client], games: int) -> List[float]:
+    """
+    Every player plays {games} rock-paper-scissors games, returns durations of games (2 round trips)
+    """
+    durations: List[float] = []
+
+    async def play(player: Client):
+        for _ in range(games):
+            start = time.perf_counter()
+            player.send("[server] rock-paper-scissors")
+            await player.expect(lambda msg: "What is your choice?" in msg)
+            player.send("rock")
+            await player.expect(lambda msg: "Your choice: rock" in msg)
+            durations.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[play(player) for player in players])
+    return durations
+
+
+async def measure(name: str, results: dict, server_pid: int, scenario):
+    """
+    Run scenario, add its throughput, latency and CPU usage to {results}
+    """
+    usage = resource_usage(server_pid)
+    start = time.perf_counter()
+    try:
+        latencies = await scenario
+    except (OSError, asyncio.TimeoutError):
+        results[name] = {"failed": True}    # server is not available anymore or too slow
+        return
+    duration = time.perf_counter() - start
+    cpu = resource_usage(server_pid)["cpu"] - usage["cpu"]
+    results[name] = dict({"count": len(latencies), "per_sec": round(len(latencies) / duration, 1),
+                          "server_cpu_percent": round(cpu / duration * 100, 1)}, **latency_stats(latencies))
+
+
+async def measure_connect(port: int, server_pid: int, count: int, results: dict) -> list:
+    """
+    Open {count} idle connections, add their rate and memory per connection to {results}
+    Returns list of stream writers
+    """
+    usage = resource_usage(server_pid)
+    start = time.perf_counter()
+    idle_writers = await open_idle_connections(port, count)
+    duration = time.perf_counter() - start
+    idle_usage = resource_usage(server_pid)
+    results["connect"] = {
+        "idle_connections": len(idle_writers),
+        "connections_per_sec": round(len(idle_writers) / duration, 1) if duration else 0,
+        "memory_per_connection_bytes": round((idle_usage["rss"] - usage["rss"]) / len(idle_writers))
+        if idle_writers else 0}
+    return idle_writers
+
+
+async def register_all(port: int, names: List[str], senders: int, registered: List[Client]) -> List[float]:
+    """
+    Register users with {names} at the same time, clients are added to {registered}
+    Returns registration latencies
+    """
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(CONCURRENT_CONNECTS)
+    registered.extend(await asyncio.gather(*[register(port, name, i == 0 or senders < i <= 2 * senders,
+                                                      semaphore, latencies) for i, name in enumerate(names)]))
+    return latencies
+
+
+async def run_benchmark(port: int, server_pid: int, args: argparse.Namespace) -> dict:
+    """
+    Run all scenarios one by one with the same server, load is set by {args} of command line
+    """
+    results: dict = {}
+    idle_writers = await measure_connect(port, server_pid, args.idle, results)
+
+    # user 0 - listener of broadcast, users 1..senders - senders, next {senders} users - peers and players
+    senders = args.senders
+    clients = max(args.clients, 2 * senders + 1)
+    names = ["bench-user-{}".format(i) for i in range(clients)]
+    registered: List[Client] = []
+    await measure("registration", results, server_pid, register_all(port, names, senders, registered))
+    if len(registered) == clients:
+        listener, senders_list = registered[0], registered[1:senders + 1]
+        peers, peer_names = registered[senders + 1:2 * senders + 1], names[senders + 1:2 * senders + 1]
+        await measure("broadcast", results, server_pid, broadcast(listener, senders_list, args.messages))
+        await measure("private", results, server_pid,
+                      private_messages(senders_list, peers, peer_names, args.messages))
+        await measure("games", results, server_pid, play_games(peers, max(args.messages // 10, 1)))
+
+    results["server"] = {"rss_bytes": round(resource_usage(server_pid)["rss"]),
+                         "cpu_seconds": round(resource_usage(server_pid)["cpu"], 2)}
+    for client in registered:
+        client.close()
+    for writer in idle_writers:
+        writer.close()
+    return results
+
+
+def flatten(results: dict, prefix: str = "") -> Dict[str, float]:
+    """
+    Nested results as {"scenario.metric": value}
+    """
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, "{}{}.".format(prefix, key)))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(old: Dict[str, float], new: Dict[str, float]):
+    """
+    Print metrics that exist in both results with relative change
+    """
+    for key, value in new.items():
+        previous = old.get(key)
+        if isinstance(value, (int, float)) and isinstance(previous, (int, float)) and not isinstance(value, bool):
+            change = "{:+.1f}%".format((value - previous) / previous * 100) if previous else "n/a"
+            print("{}: {} -> {} ({})".format(key, previous, value, change))
+
+
+def git_commit() -> Optional[str]:
+    """
+    Commit of benchmarked working tree, if it is available
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    """
+    Parse arguments, run server and benchmark, print and save results
+    """
+    parser = argparse.ArgumentParser(description="Chat server load benchmark")
+    parser.add_argument("--server", default="server.py", help="path to server.py that should be benchmarked")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--idle", type=int, default=10000, help="count of idle connections")
+    parser.add_argument("--clients", type=int, default=1000, help="count of registered clients")
+    parser.add_argument("--senders", type=int, default=10, help="count of clients sending public/private messages")
+    parser.add_argument("--messages", type=int, default=200, help="count of messages from every sender")
+    parser.add_argument("--workers", default="1", help="comma-separated counts of server processes, i.e. 1,2,4")
+    parser.add_argument("--json", help="save results to JSON file")
+    parser.add_argument("--compare", help="JSON file with previous results")
+    args = parser.parse_args()
+
+    runs = []
+    for workers in [int(count) for count in args.workers.split(",")]:
+        process = start_server(args.server, args.port, workers)
+        try:
+            results = asyncio.run(run_benchmark(args.port, process.pid, args))
+            results["server"]["alive"] = process.poll() is None
+        finally:
+            process.terminate()     # master process stops its workers
+            process.wait()
+        runs.append(dict({"workers": workers}, **results))
+        for key, value in flatten(results).items():
+            print("workers {} {}: {}".format(workers, key, value))
+
+    report = {"commit": git_commit(), "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args), "runs": runs}
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as json_file:
+            json.dump(report, json_file, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as json_file:
+            previous = json.load(json_file)
+        print("Compared with {} ({}):".format(args.compare, previous.get("commit")))
+        compare(flatten({str(run["workers"]): run for run in previous["runs"]}),
+                flatten({str(run["workers"]): run for run in runs}))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,38 @@
 import logging
+import threading
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
 
 logger = logging.getLogger('chat_logger')
 
+REQUEST_TIMEOUT = 5  # seconds
+RETRIES = 3  # count of retries for failed connections and 502/503/504 responses
+BACKOFF_FACTOR = 0.5  # sleep between retries: 0.5, 1, 2 ... seconds
+POOL_SIZE = 2  # keep-alive connections to bot: one for sending and one for receiving messages
+
 
 class Bot:
     """
     Implements work with bots using API
+    Uses one HTTP session, so connections to bot are kept alive and reused
     """
 
     def __init__(self, url):
         self.url = url
+        self.session = requests.Session()
+        retry = Retry(total=RETRIES, read=0, backoff_factor=BACKOFF_FACTOR,
+                      status_forcelist=(502, 503, 504), allowed_methods=None)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.metrics_lock = threading.Lock()  # bot is used by sending and receiving threads
+        self.request_seconds = metrics.histogram("chat_bot_request_seconds", "Duration of requests to bot", bot=url)
+        self.failures = metrics.counter("chat_bot_failures_total", "Failed requests to bot", bot=url)
 
     def name(self):
         """
@@ -19,29 +41,56 @@ class Bot:
         """
         return self.url
 
-    def get_messages(self):
+    def count_request(self, start_time: float, failed: bool):
+        """
+        Update request metrics
+        """
+        latency = time.monotonic() - start_time
+        with self.metrics_lock:
+            self.request_seconds.observe(latency)
+            self.failures.inc(failed)
+
+    def get_messages(self, wait: int = 0):
         """
         Get new messages from bot
+
+        :param wait: int, seconds that bot can hold request if there are no new messages (long polling)
+        :return: list of messages
         """
         messages = []
+        start_time = time.monotonic()
+        failed = True
         try:
-            response = requests.get(self.url)
+            response = self.session.get(self.url, params={"wait": wait}, timeout=(REQUEST_TIMEOUT,
+                                                                               wait + REQUEST_TIMEOUT))
             assert response.status_code == 200
             messages = response.json()["messages"]
+            failed = False
         except OSError:
             pass    # do nothing, maybe bot is not run (logging will break tests)
         except Exception as ex:
             logger.error("Messages were not received:(\n{}".format(ex))
+        self.count_request(start_time, failed)
         return messages
 
     def send_message(self, msg):
         """
         Send message to bot
         """
+        self.send_messages([msg])
+
+    def send_messages(self, messages):
+        """
+        Send batch of messages to bot in one request
+        """
+        start_time = time.monotonic()
+        failed = True
         try:
-            response = requests.post(self.url, data=msg)
+            response = self.session.post(self.url, json={"messages": messages}, timeout=REQUEST_TIMEOUT)
             assert response.status_code == 200
+            failed = False
         except OSError:
             pass    # do nothing, maybe bot is not run (logging will break tests)
         except Exception as ex:
-            logger.error("Message was not sent:(\n{}".format(ex))
+            logger.error("Messages were not sent:(\n{}".format(ex))
+        self.count_request(start_time, failed)
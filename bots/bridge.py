@@ -0,0 +1,116 @@
+"""
+Bridge between chat server and bot
+
+All HTTP requests to bot are done in background threads, so slow bot never stalls chat room:
+    - outbound messages are put to queue and sent to bot in batches (one POST for many messages)
+    - inbound messages are received using long polling and passed to server loop via queue
+"""
+import logging
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
+
+from bots.bot import Bot
+
+logger = logging.getLogger('chat_logger')
+
+OUTBOUND_QUEUE_SIZE = 10000  # max count of messages waiting for sending to bot
+BATCH_SIZE = 100  # max count of messages in one POST request
+LONG_POLL_TIMEOUT = 25  # seconds, how long bot can hold GET request without new messages
+POLL_INTERVAL = 1  # seconds, min interval between GET requests if bot does not support long polling
+
+
+class BotBridge:
+    """
+    Sends and receives messages of one bot in background threads
+    Bot gets public messages of one chat room and its messages are sent to this room
+    """
+
+    def __init__(self, bot: Bot, room: str):
+        self.bot = bot
+        self.room = room
+        self.outbound: queue.Queue = queue.Queue(OUTBOUND_QUEUE_SIZE)
+        self.inbound: queue.Queue = queue.Queue()
+        self.dropped = 0  # messages that were not sent because outbound queue was full
+        self.wakeup: Optional[Callable[[], None]] = None
+        self.stopped = threading.Event()
+
+    def name(self) -> str:
+        """
+        Bridge name is the same as bot name
+        """
+        return self.bot.name()
+
+    def start(self, wakeup: Callable[[], None]):
+        """
+        Start sending and receiving threads
+
+        :param wakeup: function that wakes up server loop when new messages are received
+        :return: None
+        """
+        self.wakeup = wakeup
+        threading.Thread(target=self.sending_loop, name="bot-sender", daemon=True).start()
+        threading.Thread(target=self.receiving_loop, name="bot-receiver", daemon=True).start()
+
+    def stop(self):
+        """
+        Stop sending and receiving threads
+        """
+        self.stopped.set()
+
+    def publish(self, msg: str):
+        """
+        Put message to outbound queue without blocking, message is dropped if queue is full
+
+        :param msg: str
+        :return: None
+        """
+        try:
+            self.outbound.put_nowait(msg)
+        except queue.Full:
+            if not self.dropped:
+                logger.warning("Bot '{}' is too slow, messages are dropped".format(self.name()))
+            self.dropped += 1
+
+    def received(self) -> List[str]:
+        """
+        Return all messages received from bot since the previous call
+        """
+        messages = []
+        while True:
+            try:
+                messages.append(self.inbound.get_nowait())
+            except queue.Empty:
+                return messages
+
+    def sending_loop(self):
+        """
+        Wait for outbound messages and send all accumulated ones in one request
+        """
+        while not self.stopped.is_set():
+            try:
+                batch = [self.outbound.get(timeout=1)]
+            except queue.Empty:
+                continue
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.outbound.get_nowait())
+                except queue.Empty:
+                    break
+            self.bot.send_messages(batch)
+
+    def receiving_loop(self):
+        """
+        Receive messages from bot using long polling, wake up server loop if there are new messages
+        """
+        while not self.stopped.is_set():
+            start_time = time.monotonic()
+            messages = self.bot.get_messages(LONG_POLL_TIMEOUT)
+            if messages:
+                for msg in messages:
+                    self.inbound.put(msg)
+                self.wakeup()
+            else:
+                # bot does not support long polling or is not run, do not poll it in a tight loop
+                self.stopped.wait(POLL_INTERVAL - (time.monotonic() - start_time))
@@ -9,8 +9,8 @@ Setup:
     Provide correct SLACK_TOKEN and SLACK_SIGNING_SECRET in bots/.slack_env
 
     Need to add this bot to chat room in common.py file:
-        Bot("http://127.0.0.1:5555/messages"),   # slack bot
-        (already added, just change port if you change it in this file)
+        BotBridge(Bot("http://127.0.0.1:5555/messages"), DEFAULT_ROOM),   # slack bot
+        (already added, just change port if you change it in this file or room name)
 
     Bot permissions in slack:
         - chat:write
@@ -18,18 +18,26 @@ Setup:
         - im:write
         - users:read
 
+User names of slack messages are cached (USER_CACHE_SIZE, USER_CACHE_TTL), cache is filled by users list
+at startup. Messages from slack wait for chat server in bounded queue (INBOUND_QUEUE_SIZE, OVERFLOW_POLICY).
+GET /stats returns hits and misses of the cache and count of dropped messages.
+
 Bot requirements:
     Bot should provide url that support GET and POST requests.
     GET - return list of new messages in format:
         {
             "messages": [list_of_messages]
         }
-    POST - receive message in string format that should be sent to slack channel
+        GET ?wait=N - long polling: wait up to N seconds (max MAX_WAIT) if there are no new messages
+    POST - receive message in string format or batch of messages in format:
+        {
+            "messages": [list_of_messages]
+        }
+        that should be sent to slack channel
 
 """
 
 import os
-from typing import List
 
 import slack
 from dotenv import load_dotenv
@@ -37,17 +45,27 @@ from flask import Flask, request
 from slack.errors import SlackApiError
 from slackeventsapi import SlackEventAdapter
 
+# bot is started as script, so modules of bots directory are imported without package name
+from slack_state import InboundQueue, UserNameCache, display_name     # pylint: disable=E0401
+
 # Bot settings
 PORT = 5555
 CHAT_CHANNEL = "chat"
+USER_CACHE_SIZE = 10000     # max count of cached user names, the least recently used names are removed
+USER_CACHE_TTL = 3600       # seconds, renamed users get new name in chat after this time
+INBOUND_QUEUE_SIZE = 10000  # max count of messages from slack waiting for chat server
+OVERFLOW_POLICY = "drop_oldest"  # what to do when inbound queue is full: drop_oldest or drop_newest message
+MAX_WAIT = 30               # seconds, max time of long polling GET request
 # End bot settings
 
-messages_in: List[str] = []  # messages from slack to chat
-
 load_dotenv(os.path.dirname(os.path.abspath(__file__)) + "/.slack_env")
 SLACK_TOKEN = os.environ.get("SLACK_TOKEN")
 SLACK_SIGNING_SECRET = os.environ.get("SLACK_SIGNING_SECRET")
 
+
+user_names = UserNameCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+messages_in = InboundQueue(INBOUND_QUEUE_SIZE, OVERFLOW_POLICY)  # messages from slack to chat
+
 app = Flask(__name__)
 slack_event_adapter = SlackEventAdapter(SLACK_SIGNING_SECRET, '/slack/events', app)
 
@@ -55,19 +73,32 @@ slack_event_adapter = SlackEventAdapter(SLACK_SIGNING_SECRET, '/slack/events', a
 @app.route('/messages', methods=['GET'])
 def get_messages():
     """
-    Return new messages
+    Return new messages, wait for them up to ?wait=N seconds if there are no messages yet (long polling)
     """
-    response = {"messages": messages_in.copy()}
-    messages_in.clear()
-    return response
+    try:
+        wait = min(max(float(request.args.get("wait", 0)), 0), MAX_WAIT)
+    except ValueError:
+        wait = 0
+    return {"messages": messages_in.take_all(wait)}
+
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    """
+    Return counters of user name cache and inbound queue
+    """
+    return {"user_cache": user_names.stats(), "dropped_messages": messages_in.dropped}
 
 
 @app.route('/messages', methods=['POST'])
 def send_message():
     """
-    Receive message
+    Receive message or batch of messages, batch is sent to slack as one message
     """
-    send_public_message_to_slack(request.data.decode())
+    if request.is_json:
+        send_public_message_to_slack("\n".join(request.get_json()["messages"]))
+    else:
+        send_public_message_to_slack(request.data.decode())
     return "The message was successfully received"
 
 
@@ -83,16 +114,34 @@ def set_public_chat_id(client):
     raise ValueError(f"Channel with name '{CHAT_CHANNEL}' was not found!")
 
 
+def warm_up_user_names(client):
+    """
+    Fill user name cache by users list, so names of active users are not requested one by one
+    Requires users:read permission for that
+    """
+    cursor = None
+    while True:
+        response = client.users_list(limit=200, cursor=cursor)
+        for user in response["members"]:
+            user_names.put(user["id"], display_name(user))
+        cursor = response.get("response_metadata", {}).get("next_cursor")
+        if not cursor or len(user_names.names) >= USER_CACHE_SIZE:
+            return
+
+
 def get_user_name(user_id):
     """
-    Returns username by user_id
+    Returns username by user_id, slack is requested only if name is not cached
     Requires users:read permission for that
     """
-    try:
-        username = "[{}] ".format(slack_client.users_info(user=user_id).get("user").get("real_name"))
-    except SlackApiError:
-        username = ""
-    return username
+    name = user_names.get(user_id)
+    if name is None:
+        try:
+            name = display_name(slack_client.users_info(user=user_id).get("user") or {"id": user_id})
+        except SlackApiError:
+            return ""
+        user_names.put(user_id, name)
+    return "[{}] ".format(name)
 
 
 def is_public_channel(event):
@@ -128,7 +177,8 @@ def answer_on_private_msg(channel_id, text):
     if any(map(lambda msg: msg.lower() in text.lower(), greetings)):
         send_message_to_slack(channel_id, "Hi!")
     elif "?" in text:
-        send_message_to_slack(channel_id, "Answer to the Ultimate Question of Life, the Universe, and Everything is 42")
+        send_message_to_slack(channel_id,
+                              "Answer to the Ultimate Question of Life, the Universe, and Everything is 42")
     elif any(map(lambda msg: msg.lower() in text.lower(), goodbyes)):
         send_message_to_slack(channel_id, "Bye!")
     else:
@@ -147,7 +197,7 @@ def message(payload):
 
     text = event.get('text')
     if is_public_channel(event):
-        messages_in.append(get_user_name(user_id) + text)
+        messages_in.put(get_user_name(user_id) + text)
     else:
         channel_id = event.get('channel')
         answer_on_private_msg(channel_id, text)
@@ -157,4 +207,8 @@ if __name__ == '__main__':
     slack_client = slack.WebClient(token=SLACK_TOKEN)
     bot_id = slack_client.api_call("auth.test")["user_id"]
     public_chat_id = set_public_chat_id(slack_client)
+    try:
+        warm_up_user_names(slack_client)
+    except SlackApiError:
+        pass    # names will be requested on the first messages of users
     app.run(debug=True, port=PORT)
@@ -0,0 +1,103 @@
+"""
+In-memory state of slack bot that is shared by Flask handler threads
+
+It does not depend on slack and Flask packages, so it can be tested without them.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, List, Optional, Tuple
+
+
+class UserNameCache:
+    """
+    LRU cache of user names with expiration time, it is used by Flask handler threads
+    """
+
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self.names: OrderedDict = OrderedDict()  # user id -> (name, expiration time), from least recently used
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: str) -> Optional[str]:
+        """
+        Cached name of user, None if it is not cached or expired
+        """
+        with self.lock:
+            entry: Optional[Tuple[str, float]] = self.names.get(user_id)
+            if entry is None or entry[1] < time.monotonic():
+                self.names.pop(user_id, None)
+                self.misses += 1
+                return None
+            self.names.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, user_id: str, name: str):
+        """
+        Cache name of user, the least recently used name is removed if cache is full
+        """
+        with self.lock:
+            self.names[user_id] = (name, time.monotonic() + self.ttl)
+            self.names.move_to_end(user_id)
+            while len(self.names) > self.size:
+                self.names.popitem(last=False)
+
+    def stats(self) -> dict:
+        """
+        Counters of cache usage
+        """
+        with self.lock:
+            return {"size": len(self.names), "hits": self.hits, "misses": self.misses}
+
+
+class InboundQueue:
+    """
+    Bounded queue of messages from slack to chat.
+    Slack events and GET requests of chat server are processed by different Flask threads,
+    so all operations are done under lock and GET request can wait for new messages.
+    """
+
+    def __init__(self, size: int, policy: str):
+        self.size = size
+        self.policy = policy
+        self.messages: Deque[str] = deque()
+        self.condition = threading.Condition()
+        self.dropped = 0  # messages that were dropped because queue was full
+
+    def put(self, msg: str):
+        """
+        Add message, if queue is full the oldest message (drop_oldest policy) or this message (drop_newest)
+        is dropped
+        """
+        with self.condition:
+            if len(self.messages) >= self.size:
+                self.dropped += 1
+                if self.policy == "drop_newest":
+                    return
+                self.messages.popleft()
+            self.messages.append(msg)
+            self.condition.notify_all()
+
+    def take_all(self, wait: float) -> List[str]:
+        """
+        Remove and return all messages, wait up to {wait} seconds if there are no messages
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.messages, timeout=wait)
+            messages = list(self.messages)
+            self.messages.clear()
+            return messages
+
+
+def display_name(user: dict) -> str:
+    """
+    Name of slack user for chat: real name, user name if real name is not set, user id if there are no names
+
+    :param user: dict, user object from users.info or users.list response
+    :return: str
+    """
+    return user.get("real_name") or user.get("name") or user.get("id", "")
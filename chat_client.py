@@ -0,0 +1,186 @@
+"""
+Asyncio client library for chat server
+
+One process can keep thousands of connections: every client is a pair of asyncio streams without threads.
+Used by client.py, it can be used by bots, load generators and tests.
+
+Client registers with "/seq <name>", so public messages come with sequence numbers of its room.
+After disconnection reconnect() registers with the same name and "/resume <room> <seq> <name>":
+server sends public messages that were missed in one batch (only the newest ones if there are too many).
+
+    async def main():
+        client = await chat_client.connect("localhost", 8888)
+        if await client.register("Bot"):
+            await client.send("Hello!")
+            await client.send_private("Alice", "Hi, Alice!")
+            await client.command("participants")
+            async for message in client:
+                print(message)
+        await client.close()
+"""
+import asyncio
+import re
+from collections import deque
+from typing import Deque, Optional
+import common
+
+SERVER_NAME = "server"  # recipient of server commands
+WELCOME_MSG = "Hi, {}! Welcome to chat room!"  # answer of server on successful registration
+NAME_NOT_AVAILABLE_MSG = "Name '{}' is not available"  # beginning of answer when name is taken
+SEQUENCE_PATTERN = re.compile(r"^#([\w-]{1,32}):(\d+) ")  # see common.SEQUENCE_PREFIX
+JOINED_PATTERN = re.compile(r"^\[server\] -> \[.*\] You joined room '([\w-]{1,32})'$")  # answer on [server] join
+RECONNECT_DELAYS = (0.1, 0.5, 1, 2, 5, 5, 5, 10, 10, 10)  # seconds before reconnection attempts
+
+
+class ChatClient:
+    """
+    Connection to chat server: sending messages and receiving them one by one
+    """
+
+    def __init__(self, host: str, port: int, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.host = host
+        self.port = port
+        self.reader = reader
+        self.writer = writer
+        self.decoder = common.FrameDecoder()
+        self.messages: Deque[str] = deque()  # received messages that were not returned by receive yet
+        self.name: Optional[str] = None  # username after registration
+        self.pending_name: Optional[str] = None  # username that was sent to server, but not accepted yet
+        self.room = ""  # room and sequence number of the last received public message
+        self.seq = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        try:
+            return await self.receive()
+        except ConnectionError:
+            raise StopAsyncIteration from None
+
+    async def receive(self) -> str:
+        """
+        Next message from server, it waits until message is received.
+        Sequence number is removed from public message and remembered as resume point.
+
+        :return: str, message
+        :raise ConnectionError: connection was closed or server sent wrong frame
+        """
+        while not self.messages:
+            data = await self.reader.read(common.BUFFER_SIZE)
+            if not data:
+                raise ConnectionError("Connection was closed by server")
+            self.messages.extend(self.decoder.feed(data))
+        message = self.messages.popleft()
+        match = SEQUENCE_PATTERN.match(message)
+        if match:
+            self.room, self.seq = match.group(1), int(match.group(2))
+            return message[match.end():]
+        match = JOINED_PATTERN.match(message)
+        if match:
+            self.room, self.seq = match.group(1), 0  # the last messages of new room are received next
+        elif self.pending_name is not None and message == WELCOME_MSG.format(self.pending_name):
+            self.name, self.pending_name = self.pending_name, None
+        return message
+
+    async def send_name(self, name: str):
+        """
+        Send username (or resume request after reconnection), registration is completed
+        when receive gets welcome message. It can be used when answers of server are shown to user as is.
+        """
+        name = name.strip()
+        if not name:
+            raise ValueError("Username should not be empty")
+        self.pending_name = name
+        if self.room:
+            await self.send("{} {} {} {}".format(common.RESUME_REGISTRATION, self.room, self.seq, name))
+        else:
+            await self.send("{} {}".format(common.SEQUENCED_REGISTRATION, name))
+
+    async def register(self, name: str) -> bool:
+        """
+        Register with username, greeting of server is skipped.
+        The last messages of the room that server sends after registration can be received as usual.
+
+        :param name: str, username
+        :return: bool, False if name is not available
+        """
+        await self.send_name(name)
+        while self.pending_name is not None:
+            message = await self.receive()
+            if message.startswith(NAME_NOT_AVAILABLE_MSG.format(self.pending_name)):
+                self.pending_name = None
+                return False
+        return True
+
+    async def reconnect(self) -> bool:
+        """
+        Connect again and register with the same name, messages that were missed are received as usual.
+        Attempts are repeated with delays from RECONNECT_DELAYS (name can be still taken by the old connection
+        until server notices disconnection).
+
+        :return: bool, False if all attempts failed
+        """
+        name = self.name
+        if name is None:
+            raise ValueError("Client was not registered")
+        await self.close()
+        for delay in RECONNECT_DELAYS:
+            await asyncio.sleep(delay)
+            try:
+                self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+                self.decoder = common.FrameDecoder()
+                self.messages.clear()
+                if await self.register(name):
+                    return True
+                await self.close()
+            except OSError:
+                continue
+        return False
+
+    async def send(self, msg: str):
+        """
+        Send public message to the current room, it waits only if socket buffer is full
+
+        :raise ValueError: message is longer than server accepts (common.MAX_CLIENT_MESSAGE_SIZE)
+        """
+        if self.writer.is_closing():
+            raise ConnectionError("Connection is closed")
+        frame = common.encode_frame(msg)
+        if len(frame) - common.FRAME_HEADER.size > common.MAX_CLIENT_MESSAGE_SIZE:
+            raise ValueError("Message is too long: {} bytes, max size is {} bytes"
+                             .format(len(frame) - common.FRAME_HEADER.size, common.MAX_CLIENT_MESSAGE_SIZE))
+        self.writer.write(frame)
+        await self.writer.drain()
+
+    async def send_private(self, recipient: str, msg: str):
+        """
+        Send private message to {recipient}
+        """
+        await self.send("[{}] {}".format(recipient, msg))
+
+    async def command(self, cmd: str):
+        """
+        Send command to server, i.e. "participants" or "join dev", answer can be received as usual
+        """
+        await self.send_private(SERVER_NAME, cmd)
+
+    async def close(self):
+        """
+        Close connection
+        """
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+async def connect(host: str, port: int = common.DEFAULT_PORT) -> ChatClient:
+    """
+    Connect to chat server
+
+    :return: ChatClient, connected but not registered client
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    return ChatClient(host, port, reader, writer)
@@ -1,66 +1,79 @@
 """
 Create client socket and connect to server socket.
-Just receives and sends messages
+Just receives and sends messages: incoming messages are read by asyncio stream reader task,
+console input is read by another task, so they never block each other
 
 Start:
 - for connecting to localhost:     python client.py
 - for connecting to remote host:   python client.py ip_address port
 
-See server documentation for details about chat features
+See server documentation for details about chat features, see chat_client.py for client library
 """
 import logging.config
-import select
 import socket
 import sys
 import asyncio
-from concurrent.futures import FIRST_COMPLETED
 from aioconsole import ainput
+import chat_client
 import common
 
-client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 logger = logging.getLogger('chat_logger')
 
 
-async def receiving_messages(loop):
+async def receiving_messages(client: chat_client.ChatClient):
     """
-    Receiving messages from server
+    Receiving messages from server, they are shown as soon as they arrive.
+    Registered client reconnects after disconnection and gets public messages that were missed.
     """
     while True:
-        try:
-            read_sockets, _, _ = select.select([client_socket], [], [], 1)
-
-            for socks in read_sockets:
-                if socks == client_socket:
-                    # message = socks.recv(common.BUFFER_SIZE).decode().strip()
-                    message = (await loop.sock_recv(socks, common.BUFFER_SIZE)).decode().strip()
-                    logger.info(message)
-            await asyncio.sleep(0.03)
-        except ConnectionError:
+        async for message in client:
+            logger.info(message.strip())
+        if client.name is None:
             logger.warning("You were disconnected.")
-            break
+            return
+        logger.warning("You were disconnected. Reconnecting...")
+        if not await client.reconnect():
+            logger.warning("Server is not available.")
+            return
+        logger.info("Reconnected.")
 
 
-async def sending_messages(loop):
+async def sending_messages(client: chat_client.ChatClient):
     """
-    Get message from console input and send it to server
+    Get message from console input and send it to server, messages before registration are usernames
     """
     while True:
-        message = (await ainput()).strip()
+        try:
+            message = (await ainput()).strip()
+        except EOFError:    # console input was closed
+            return
         if message:
             try:
-                await loop.sock_sendall(client_socket, message.encode())
+                if client.name is None:
+                    await client.send_name(message)
+                else:
+                    await client.send(message)
             except ConnectionError:
-                logger.warning("You were disconnected.")
-                break
+                logger.warning("Message was not sent: you are disconnected.")
+            except ValueError as ex:
+                logger.warning("Message was not sent: {}".format(ex))
 
 
-def process_messages():
+async def process_messages(host: str, remote_ip: str, port: int):
     """
-    Run receiving/sending messages using asyncio
+    Connect to server and run receiving/sending messages until one of them is finished
     """
-    loop = asyncio.get_event_loop()
-    tasks = [receiving_messages(loop), sending_messages(loop)]
-    loop.run_until_complete(asyncio.wait(tasks, return_when=FIRST_COMPLETED))
+    client = await chat_client.connect(remote_ip, port)
+    logger.info("Socket Connected to {} on ip {}".format(host, remote_ip))
+    tasks = [asyncio.ensure_future(receiving_messages(client)), asyncio.ensure_future(sending_messages(client))]
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        for task in done:
+            task.result()   # raise error of finished task
+    finally:
+        await client.close()
 
 
 def start_client():
@@ -82,13 +95,10 @@ def start_client():
         logger.error("Hostname could not be resolved. Exiting")
         sys.exit()
 
-    client_socket.connect((remote_ip, port))
-
-    logger.info("Socket Connected to {} on ip {}".format(host, remote_ip))
-
-    process_messages()
-
-    client_socket.close()
+    try:
+        asyncio.run(process_messages(host, remote_ip, port))
+    except ConnectionError as ex:
+        logger.error("Connection error: {}".format(ex))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,308 @@
+"""
+Multi-process mode of chat server
+
+Master process starts CHAT_WORKERS copies of server.py, all of them accept connections on the same port
+(SO_REUSEPORT, kernel balances new connections between workers). Workers are connected to message bus
+in master process using Unix socket:
+    - public messages are sent to the bus and delivered to room members on all workers
+    - usernames are claimed on the bus, so they are unique for all workers
+    - private messages to users of other workers are routed by the bus
+
+Every event is one JSON object in frame (see common.encode_frame), events produced during one iteration
+of event loop are sent together.
+
+Start:
+    CHAT_WORKERS=4 python server.py
+"""
+import json
+import logging
+import os
+import selectors
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Set, Tuple
+
+import common
+import metrics
+from history import MESSAGE_LOG_DIR
+
+logger = logging.getLogger('chat_logger')
+
+WORKERS = int(os.environ.get("CHAT_WORKERS", "1"))  # count of worker processes, 1 - run server in one process
+WORKER_ID = int(os.environ.get("CHAT_WORKER_ID", "0"))  # number of worker, set by master process
+BUS_PATH = os.environ.get("CHAT_BUS_PATH")  # Unix socket of message bus, set by master process
+BUS_MAX_FRAME_SIZE = 8 * common.MAX_MESSAGE_SIZE  # message is escaped in JSON event
+
+
+class Link:
+    """
+    Non-blocking connection between processes, sends and receives events
+    """
+
+    def __init__(self, sock: socket.socket, selector: selectors.BaseSelector):
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.selector = selector
+        self.selector.register(sock, selectors.EVENT_READ)
+        self.decoder = common.FrameDecoder(BUS_MAX_FRAME_SIZE)
+        self.pending: List[bytes] = []  # events of the current loop iteration
+        self.outbox = bytearray()  # data that was not accepted by socket yet
+        self.waiting_write = False
+
+    def send(self, event: dict):
+        """
+        Queue event, it is sent by the next flush
+        """
+        self.pending.append(common.encode_frame(json.dumps(event, ensure_ascii=False)))
+
+    def receive(self) -> List[dict]:
+        """
+        Read events from readable socket
+        """
+        return [json.loads(msg) for msg in self.decoder.read(self.sock)]
+
+    def flush(self):
+        """
+        Send queued events without blocking, socket is registered for EVENT_WRITE until everything is sent
+        """
+        if self.pending:
+            self.outbox += b"".join(self.pending)
+            self.pending.clear()
+        if self.outbox:
+            try:
+                del self.outbox[:self.sock.send(self.outbox)]
+            except BlockingIOError:
+                pass
+        if self.waiting_write != bool(self.outbox):
+            self.waiting_write = bool(self.outbox)
+            self.selector.modify(self.sock, selectors.EVENT_READ | selectors.EVENT_WRITE
+                                 if self.waiting_write else selectors.EVENT_READ)
+
+    def close(self):
+        """
+        Unregister and close socket
+        """
+        self.selector.unregister(self.sock)
+        self.sock.close()
+
+
+class Bus:
+    """
+    Connection of worker process to message bus + directory of users connected to other workers
+    """
+
+    def __init__(self, path: str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        self.link = Link(sock, common.selector)
+        self.users: Dict[str, str] = {}  # casefolded name -> name of users connected to other workers
+        self.claims: Dict[int, Tuple[socket.socket, str]] = {}  # claim id -> socket and name waiting for answer
+        self.claiming: Set[socket.socket] = set()
+        self.last_claim_id = 0
+
+    def is_available(self, name: str) -> bool:
+        """
+        Check that nobody is registered with the same case-insensitive name on other workers
+        """
+        return name.casefold() not in self.users
+
+    def is_claiming(self, sock: socket.socket) -> bool:
+        """
+        Check that socket is waiting for answer to its claim
+        """
+        return sock in self.claiming
+
+    def names(self) -> List[str]:
+        """
+        Usernames of users connected to other workers
+        """
+        return list(self.users.values())
+
+    def claim(self, sock: socket.socket, name: str):
+        """
+        Ask bus to reserve username, answer is received as "claimed" event
+        """
+        self.last_claim_id += 1
+        self.claims[self.last_claim_id] = (sock, name)
+        self.claiming.add(sock)
+        self.link.send({"type": "claim", "id": self.last_claim_id, "name": name})
+
+    def answer(self, event: dict) -> Tuple[socket.socket, str]:
+        """
+        Socket and name of answered claim
+        """
+        sock, name = self.claims.pop(event["id"])
+        self.claiming.discard(sock)
+        return sock, name
+
+    def release(self, name: str):
+        """
+        Free username of disconnected user
+        """
+        self.link.send({"type": "release", "name": name})
+
+    def publish(self, room: str, msg: str, to_history: bool):
+        """
+        Send public message to members of {room} on other workers
+        """
+        self.link.send({"type": "room", "room": room, "msg": msg, "history": to_history})
+
+    def send_private(self, name: str, msg: str) -> bool:
+        """
+        Send private message to user of another worker
+
+        :return: bool, False if there is no such user
+        """
+        name = self.users.get(name.casefold())
+        if name is None:
+            return False
+        self.link.send({"type": "private", "to": name, "msg": msg})
+        return True
+
+    def receive(self) -> List[dict]:
+        """
+        Read events from bus, user directory is updated here, other events are returned to server
+        """
+        events = []
+        for event in self.link.receive():
+            if event["type"] == "joined":
+                self.users[event["name"].casefold()] = event["name"]
+            elif event["type"] == "left":
+                self.users.pop(event["name"].casefold(), None)
+            else:
+                events.append(event)
+        return events
+
+
+class BusHub:
+    """
+    Message bus in master process: routes events between workers and keeps registry of usernames
+    """
+
+    def __init__(self, path: str):
+        self.selector = selectors.DefaultSelector()
+        self.server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server_socket.bind(path)
+        self.server_socket.listen()
+        self.selector.register(self.server_socket, selectors.EVENT_READ)
+        self.links: Dict[socket.socket, Link] = {}
+        self.users: Dict[str, Tuple[str, Link]] = {}  # casefolded name -> name and link to its worker
+
+    def broadcast(self, event: dict, origin: Link):
+        """
+        Send event to all workers except {origin}
+        """
+        for link in self.links.values():
+            if link is not origin:
+                link.send(event)
+
+    def connect(self):
+        """
+        Accept worker connection and send it the current user directory
+        """
+        sock, _ = self.server_socket.accept()
+        link = self.links[sock] = Link(sock, self.selector)
+        for name, _ in self.users.values():
+            link.send({"type": "joined", "name": name})
+
+    def disconnect(self, link: Link):
+        """
+        Worker was stopped, release its usernames
+        """
+        del self.links[link.sock]
+        link.close()
+        for folded_name, (name, owner) in list(self.users.items()):
+            if owner is link:
+                del self.users[folded_name]
+                self.broadcast({"type": "left", "name": name}, link)
+
+    def process(self, link: Link, event: dict):
+        """
+        Process one event from worker
+        """
+        event_type = event["type"]
+        if event_type == "room":
+            self.broadcast(event, link)
+        elif event_type == "private":
+            owner = self.users.get(event["to"].casefold())
+            if owner is not None:
+                owner[1].send(event)
+        elif event_type == "claim":
+            accepted = event["name"].casefold() not in self.users
+            link.send({"type": "claimed", "id": event["id"], "ok": accepted})
+            if accepted:
+                self.users[event["name"].casefold()] = (event["name"], link)
+                self.broadcast({"type": "joined", "name": event["name"]}, link)
+        elif event_type == "release":
+            owner = self.users.get(event["name"].casefold())
+            if owner is not None and owner[1] is link:
+                del self.users[event["name"].casefold()]
+                self.broadcast({"type": "left", "name": event["name"]}, link)
+
+    def run(self, processes: List[subprocess.Popen]):
+        """
+        Route events until all worker processes are stopped
+        """
+        while any(process.poll() is None for process in processes):
+            self.poll(timeout=1)
+
+    def poll(self, timeout: float):
+        """
+        Process events that are received during {timeout} seconds, send all queued events
+        """
+        for key, mask in self.selector.select(timeout):
+            if key.fileobj is self.server_socket:
+                self.connect()
+                continue
+            link = self.links.get(key.fileobj)
+            if link is None:
+                continue
+            try:
+                if mask & selectors.EVENT_READ:
+                    for event in link.receive():
+                        self.process(link, event)
+                if mask & selectors.EVENT_WRITE:
+                    link.flush()
+            except ConnectionError:
+                self.disconnect(link)
+        for link in list(self.links.values()):
+            try:
+                link.flush()
+            except ConnectionError:
+                self.disconnect(link)
+
+
+def run_workers(count: int):
+    """
+    Start message bus and {count} worker processes with the same command line arguments.
+    Every worker writes its own copy of message log to CHAT_LOG_DIR/worker-N
+    and exports its metrics on CHAT_METRICS_PORT + N.
+    """
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit())     # stop workers in finally block
+    directory = tempfile.mkdtemp(prefix="chat-bus-")
+    path = os.path.join(directory, "bus.sock")
+    hub = BusHub(path)
+    processes = []
+    try:
+        for worker_id in range(count):
+            env = dict(os.environ, CHAT_WORKERS="1", CHAT_WORKER_ID=str(worker_id), CHAT_BUS_PATH=path)
+            if MESSAGE_LOG_DIR:
+                env["CHAT_LOG_DIR"] = os.path.join(MESSAGE_LOG_DIR, "worker-{}".format(worker_id))
+            if metrics.METRICS_PORT:
+                env["CHAT_METRICS_PORT"] = str(metrics.METRICS_PORT + worker_id)
+            process = subprocess.Popen([sys.executable] + sys.argv, env=env)  # pylint: disable=R1732     # see finally
+            processes.append(process)
+        logger.info("Started {} worker processes".format(count))
+        hub.run(processes)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        shutil.rmtree(directory, ignore_errors=True)
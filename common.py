@@ -1,79 +1,258 @@
 """
 Low-level functionality with sockets + global variables
 """
+import atexit
+import selectors
 import socket
+import struct
 import sys
-from typing import Dict, Callable
+from collections import deque
+from itertools import islice
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple, Union, TYPE_CHECKING
 import logging.config
-import time
 
+import metrics
 from bots.bot import Bot
+from bots.bridge import BotBridge
+from history import HISTORY_REPLAY_COUNT, MAX_HISTORY_REPLAY
+from games import GameSession
+from rooms import Rooms, Room, DEFAULT_ROOM, ROOM_NAME_PATTERN
+from scheduler import ScheduledCall, Scheduler
 
-BUFFER_SIZE = 2048
+if TYPE_CHECKING:
+    from cluster import Bus
+    from federation import Federation
+
+BUFFER_SIZE = 65536
+MAX_MESSAGE_SIZE = 65536  # max size of one encoded message, bigger frames break connection
+MAX_PREFIX_SIZE = 1024  # bytes that server can add to message from client: sequence number, sender and room names
+MAX_CLIENT_MESSAGE_SIZE = MAX_MESSAGE_SIZE - MAX_PREFIX_SIZE  # so forwarded message fits into frame of receivers
+MAX_NAME_LENGTH = 64  # max count of characters in username, long names would not fit into MAX_PREFIX_SIZE
+FRAME_HEADER = struct.Struct("!I")  # every message is sent as 4-byte big-endian length + utf-8 encoded text
 DEFAULT_PORT = 8888
 INIT_GAME_MSG = "init_game"
-STOP_GAME_MSG = "stop_game"
+OUTBOX_HIGH_WATER_MARK = 256 * 1024  # max bytes waiting for sending to one client
+MAX_REPLAY_SIZE = OUTBOX_HIGH_WATER_MARK // 2  # bytes, the oldest messages of bigger history replies are not sent
+SLOW_CONSUMER_POLICY = "disconnect"  # what to do with client over high-water mark: drop, coalesce or disconnect
+IOV_MAX = 1024  # max count of buffers for one sendmsg call
+SENDMSG_SUPPORTED = hasattr(socket.socket, "sendmsg")  # scatter/gather sending is not available on Windows
+SEQUENCED_REGISTRATION = "/seq"  # "/seq <name>" - register and get public messages with sequence numbers
+RESUME_REGISTRATION = "/resume"  # "/resume <room> <seq> <name>" - the same + get messages of room after seq
+SEQUENCE_PREFIX = "#{}:{} "  # public messages are sent to sequenced clients as "#<room>:<seq> <message>"
 
 server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-sockets_list: Dict[socket.socket, str] = {}
-one_player_game_list: Dict[socket.socket, Dict] = {}  # contains active one player games with their progresses if needed
-all_player_game: Dict[str, Callable] = {}  # contains active all player game with its progress
+selector = selectors.DefaultSelector()  # epoll/kqueue when available, sockets are registered once
+one_player_game_list: Dict[socket.socket, GameSession] = {}  # contains active one player games with their progresses
+all_player_games: Dict[str, GameSession] = {}  # room name -> active all player game of the room with its progress
+scheduler = Scheduler()  # delayed calls (i.e. game timeouts) that are run by server loop
+log_sync_call: Optional[ScheduledCall] = None  # timed flush of message logs that have unsynced messages
+broken_sockets: Set[socket.socket] = set()  # client sockets that should be disconnected by server loop
+decoders: Dict[socket.socket, "FrameDecoder"] = {}  # incomplete frames received from client sockets
+sequenced: Set[socket.socket] = set()  # clients that get public messages with sequence numbers
+# client -> (sequenced, (room, seq) to resume or None) until its username is accepted, see parse_registration
+registration_options: Dict[socket.socket, Tuple[bool, Optional[Tuple[str, int]]]] = {}
+rooms = Rooms()  # members and history of chat rooms
+atexit.register(rooms.close)
+# set by server on start, so they are variables, not constants
+bus: Optional["Bus"] = None  # pylint: disable=C0103     # connection to other worker processes, see cluster.py
+federation: Optional["Federation"] = None  # pylint: disable=C0103     # links to other servers, see federation.py
 
 logging.config.fileConfig('logging.conf')
 logger = logging.getLogger('chat_logger')
+messages_logger = logging.getLogger('chat_logger.messages')  # content of chat messages, can be sampled
 
-bots = [
-    Bot("http://127.0.0.1:5555/messages"),   # slack bot
+bot_bridges = [  # started by server, bot requests are done in background threads
+    BotBridge(Bot("http://127.0.0.1:5555/messages"), DEFAULT_ROOM),   # slack bot
 ]
 
+RECEIVED_BYTES = metrics.counter("chat_received_bytes_total", "Bytes received from sockets")
+SENT_BYTES = metrics.counter("chat_sent_bytes_total", "Bytes sent to client sockets")
+RECV_SECONDS = metrics.histogram("chat_recv_seconds", "Duration of recv calls")
+DECODE_SECONDS = metrics.histogram("chat_decode_seconds", "Duration of decoding received data to messages")
+FANOUT_ROOM_SECONDS = metrics.histogram("chat_fanout_seconds", "Duration of sending one message to all recipients",
+                                        scope="room")
+SLOW_CONSUMERS = metrics.counter("chat_slow_consumer_events_total", "Messages to clients over high-water mark")
+
 
-class Timer:
+class ProtocolError(ConnectionError):
     """
-    Context manager for checking code performance
+    Peer sent data that can not be decoded as frames
     """
-    def __init__(self, name):
-        self.name = name
-        self.start_time = None
 
-    def __enter__(self):
-        self.start_time = time.time()
-        return self
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        duration = (time.time() - self.start_time) * 1000
-        logger.debug("{}: {}".format(self.name, duration))
+def encode_frame(msg: str) -> bytes:
+    """
+    Encode message to frame: 4-byte big-endian length + utf-8 encoded message
+
+    :param msg: str
+    :return: bytes
+    """
+    data = msg.encode()
+    return FRAME_HEADER.pack(len(data)) + data
+
 
+# buffer for recv_into shared by all decoders: sockets are read one by one in server loop thread
+# and feed copies received data, so connections don't keep their own receive buffers
+recv_buffer = memoryview(bytearray(BUFFER_SIZE))
 
-def timer(fun):
+
+class FrameDecoder:
     """
-    Decorator for checking function performance
+    Incremental decoder of frames from stream socket.
+    One recv can contain many frames and one frame can be split between many recv calls,
+    incomplete data stays in buffer until the rest of frame is received.
     """
-    def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = fun(*args, **kwargs)
-        duration = (time.time() - start_time) * 1000
-        logger.debug("{}: {}".format(fun.__name__, duration))
-        return result
-    return wrapper
+    def __init__(self, max_size: int = MAX_MESSAGE_SIZE):
+        self.max_size = max_size
+        self.buffer = bytearray()
+
+    def feed(self, data: Union[bytes, memoryview]) -> List[str]:
+        """
+        Add received data to buffer and return all completed messages
+
+        :param data: bytes, data received from socket
+        :return: list of messages
+        """
+        buffer = self.buffer
+        buffer += data
+        messages = []
+        pos = 0
+        while len(buffer) - pos >= FRAME_HEADER.size:
+            (size,) = FRAME_HEADER.unpack_from(buffer, pos)
+            if size > self.max_size:
+                raise ProtocolError("Frame size {} is over limit {}".format(size, self.max_size))
+            end = pos + FRAME_HEADER.size + size
+            if end > len(buffer):
+                break
+            messages.append(buffer[pos + FRAME_HEADER.size:end].decode(errors="replace"))
+            pos = end
+        del buffer[:pos]
+        return messages
 
+    def read(self, sock: socket.socket) -> List[str]:
+        """
+        Receive data from socket and return all completed messages
 
-def get_socket_by_name(name: str):
+        :param sock: socket, readable socket
+        :return: list of messages
+        """
+        with metrics.Timer(RECV_SECONDS):
+            size = sock.recv_into(recv_buffer)
+        if not size:
+            raise ConnectionError("Connection was closed by peer")
+        RECEIVED_BYTES.inc(size)
+        with metrics.Timer(DECODE_SECONDS):
+            return self.feed(recv_buffer[:size])
+
+
+class Outbox:
+    """
+    Outbound queue of one client socket.
+    Data is sent right away if socket is writable, the rest is sent when selector reports writability.
     """
-    Get key by value from {sockets_list} dictionary
-    TODO: add dict with (value: key) items if participant count increases
+    def __init__(self):
+        self.chunks: Deque[Union[bytes, memoryview]] = deque()
+        self.size = 0               # bytes waiting for sending
+        self.skipped = 0            # messages skipped because of high-water mark
+        self.waiting_write = False  # socket is registered in selector for EVENT_WRITE
 
-    :param name: str, username that should be unique
-    :return: socket or None
+
+outboxes: Dict[socket.socket, Outbox] = {}
+
+
+class Participants:
+    """
+    Registry of connected sockets and their usernames.
+    Keeps both directions (socket -> name, name -> socket) and index of case-insensitive names,
+    so registration and lookups don't depend on participant count.
     """
-    for sock in sockets_list:
-        if sockets_list[sock] == name:
-            return sock
-    return None
+    def __init__(self):
+        self.by_socket: Dict[socket.socket, str] = {}       # all connected sockets, "" if user is not registered yet
+        self.by_name: Dict[str, socket.socket] = {}         # registered users in registration order
+        self.by_folded_name: Dict[str, str] = {}            # casefolded name -> registered name
+
+    def __contains__(self, sock: socket.socket) -> bool:
+        return sock in self.by_socket
+
+    def __len__(self) -> int:
+        """
+        Count of registered users (including server)
+        """
+        return len(self.by_name)
+
+    def connect(self, sock: socket.socket):
+        """
+        Add connected socket, user should be registered later
+        """
+        self.by_socket[sock] = ""
+
+    def register(self, sock: socket.socket, name: str):
+        """
+        Register username for connected socket
+        """
+        self.by_socket[sock] = name
+        self.by_name[name] = sock
+        self.by_folded_name[name.casefold()] = name
+
+    def remove(self, sock: socket.socket) -> str:
+        """
+        Remove socket and its username
+
+        :param sock: socket
+        :return: str, username ("" if user was not registered)
+        """
+        name = self.by_socket.pop(sock)
+        if name:
+            del self.by_name[name]
+            del self.by_folded_name[name.casefold()]
+        return name
+
+    def name(self, sock: socket.socket) -> str:
+        """
+        Username of socket ("" if user is not registered yet)
+        """
+        return self.by_socket[sock]
+
+    def get_socket(self, name: str) -> Optional[socket.socket]:
+        """
+        Socket of registered user, exact name has priority over case-insensitive one
+
+        :param name: str, username
+        :return: socket or None
+        """
+        sock = self.by_name.get(name)
+        if sock is None:
+            sock = self.by_name.get(self.by_folded_name.get(name.casefold(), ""))
+        return sock
 
+    def is_available(self, name: str) -> bool:
+        """
+        Check that nobody is registered with the same case-insensitive name
+        """
+        return name.casefold() not in self.by_folded_name
 
-def create_server_socket():
+    def names(self) -> List[str]:
+        """
+        Usernames of all registered users (including server) in registration order
+        """
+        return list(self.by_name)
+
+    def sockets(self) -> Iterable[socket.socket]:
+        """
+        Sockets of all registered users (including server)
+        """
+        return self.by_name.values()
+
+
+participants = Participants()
+
+
+def create_server_socket(reuse_port: bool = False):
     """
     Create server socket
+
+    :param reuse_port: bool, allow other processes to accept connections on the same port (SO_REUSEPORT)
+    :return: None
     """
     if len(sys.argv) == 3:
         host = str(sys.argv[1])
@@ -87,41 +266,187 @@ def create_server_socket():
     try:
         # fix for tests in Linux: port is not available a few seconds after killing the subprocess
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
         server_socket.bind((host, port))
     except socket.error as msg:
         logger.error("Bind failed. Error: {}".format(msg))
         sys.exit()
 
-    server_socket.listen(100)
+    server_socket.listen(socket.SOMAXCONN)
+    server_socket.setblocking(False)
+    selector.register(server_socket, selectors.EVENT_READ)
     logger.info("Server started successfully")
-    sockets_list[server_socket] = "server"
+    participants.register(server_socket, "server")
+
+
+def add_client_socket(sock: socket.socket):
+    """
+    Make client socket non-blocking, create its outbox and register it in selector
+
+    :param sock: socket, just accepted client socket
+    :return: None
+    """
+    sock.setblocking(False)
+    participants.connect(sock)
+    outboxes[sock] = Outbox()
+    decoders[sock] = FrameDecoder(MAX_CLIENT_MESSAGE_SIZE)
+    selector.register(sock, selectors.EVENT_READ)
+
+
+def remove_client_socket(sock: socket.socket) -> str:
+    """
+    Unregister client socket from selector, drop its outbox and close it
+
+    :param sock: socket
+    :return: str, username of disconnected client ("" if client was not registered)
+    """
+    selector.unregister(sock)
+    outboxes.pop(sock, None)
+    decoders.pop(sock, None)
+    one_player_game_list.pop(sock, None)
+    sequenced.discard(sock)
+    registration_options.pop(sock, None)
+    broken_sockets.discard(sock)
+    sock.close()
+    return participants.remove(sock)
+
+
+def flush(sock: socket.socket):
+    """
+    Send as much data from socket outbox as socket accepts without blocking.
+    Socket is registered for EVENT_WRITE until its outbox becomes empty.
+
+    :param sock: socket
+    :return: None
+    """
+    outbox = outboxes[sock]
+    try:
+        while outbox.chunks:
+            batch = list(islice(outbox.chunks, IOV_MAX))
+            sent = sock.sendmsg(batch) if SENDMSG_SUPPORTED else sock.send(b"".join(batch))
+            outbox.size -= sent
+            SENT_BYTES.inc(sent)
+            while outbox.chunks and sent >= len(outbox.chunks[0]):
+                sent -= len(outbox.chunks.popleft())
+            if sent:
+                outbox.chunks[0] = memoryview(outbox.chunks[0])[sent:]
+    except BlockingIOError:
+        pass
+    except OSError:
+        outbox.chunks.clear()
+        outbox.size = 0
+        broken_sockets.add(sock)
+        return
+
+    if not outbox.chunks and outbox.skipped:
+        skipped, outbox.skipped = outbox.skipped, 0
+        if SLOW_CONSUMER_POLICY == "coalesce":
+            send_to_one(sock, "{} message(s) were skipped, your connection is too slow".format(skipped))
+            return
+    if outbox.waiting_write != bool(outbox.chunks):
+        outbox.waiting_write = bool(outbox.chunks)
+        selector.modify(sock, selectors.EVENT_READ | selectors.EVENT_WRITE if outbox.waiting_write
+                        else selectors.EVENT_READ)
+
+
+def send_data(sock: socket.socket, data: bytes):
+    """
+    Put encoded frame(s) to socket outbox and try to send them without blocking.
+    If client does not read its messages and outbox is over OUTBOX_HIGH_WATER_MARK,
+    SLOW_CONSUMER_POLICY is applied:
+        - drop - new data is dropped
+        - coalesce - new data is dropped, client gets one notice about all skipped messages later
+        - disconnect - client is disconnected
+
+    :param sock: socket
+    :param data: bytes, encoded frame(s)
+    :return: None
+    """
+    outbox = outboxes.get(sock)
+    if outbox is None or sock in broken_sockets:
+        return
+    if outbox.size + len(data) > OUTBOX_HIGH_WATER_MARK:
+        SLOW_CONSUMERS.inc()
+        if not outbox.skipped:
+            logger.warning("Slow consumer '{}', outbox size: {}".format(participants.name(sock), outbox.size))
+        if SLOW_CONSUMER_POLICY == "disconnect":
+            outbox.chunks.clear()
+            outbox.size = 0
+            broken_sockets.add(sock)
+        else:
+            outbox.skipped += 1
+        return
+    outbox.chunks.append(data)
+    outbox.size += len(data)
+    if not outbox.waiting_write:
+        flush(sock)
 
 
 def send_to_one(sock: socket.socket, msg: str):
     """
-    Wrapper for socket.sendall
+    Encode message and send it to socket, see send_data for details
 
     :param sock: socket
     :param msg: str
     :return: None
     """
-    sock.sendall(msg.encode())
+    frame = encode_frame(msg)
+    if is_over_limit(frame):
+        return
+    send_data(sock, frame)
+
+
+def is_over_limit(frame: bytes) -> bool:
+    """
+    Check that frame is bigger than MAX_MESSAGE_SIZE, such frame would break connection of receiver,
+    so it should not be sent (error is logged)
+    """
+    if len(frame) - FRAME_HEADER.size <= MAX_MESSAGE_SIZE:
+        return False
+    logger.error("Message of {} bytes is over limit {}, it is not sent: {}..."
+                 .format(len(frame) - FRAME_HEADER.size, MAX_MESSAGE_SIZE,
+                         frame[FRAME_HEADER.size:80].decode(errors="replace")))
+    return True
 
 
-def send_to_all(msg: str, ignore_socket: socket.socket = None, ignore_bot: str = None):
+def send_to_room(room: Room, msg: str, ignore_socket: socket.socket = None, ignore_bot: str = None,
+                 to_history: bool = False):
     """
-    Send {message} to all connected client sockets except {ignore_socket} + print in server log
+    Send {message} to members of {room} on all worker processes and linked servers + print in server log,
+    see send_to_room_members for details
     """
-    logger.info(msg)
-    msg += "\n"
-    for sock in sockets_list:
-        if sock not in [ignore_socket, server_socket] and sockets_list[sock]:
-            send_to_one(sock, msg)
+    messages_logger.info(msg)
+    send_to_room_members(room, msg, ignore_socket, ignore_bot, to_history)
+    if bus is not None:
+        bus.publish(room.name, msg, to_history)
+    if federation is not None:
+        federation.publish(room.name, msg, to_history)
+
 
-    for bot in bots:
-        if bot.name() != ignore_bot:
-            bot.send_message(msg)
+def send_to_room_members(room: Room, msg: str, ignore_socket: socket.socket = None, ignore_bot: str = None,
+                         to_history: bool = False):
+    """
+    Send {message} to members of {room} except {ignore_socket} and to bots connected to this room
+    Public messages from users and bots are saved {to_history}, server notifications are not
+    """
+    frame = encode_frame(msg)
+    if is_over_limit(frame):
+        return
+    sequenced_frame = frame
+    if to_history:
+        seq = room.save(frame)
+        if sequenced:
+            sequenced_frame = encode_frame(SEQUENCE_PREFIX.format(room.name, seq) + msg)
+    with metrics.Timer(FANOUT_ROOM_SECONDS):
+        for sock in room.members:
+            if sock is not ignore_socket:
+                send_data(sock, sequenced_frame if sock in sequenced else frame)
+
+    for bridge in bot_bridges:
+        if bridge.room == room.name and bridge.name() != ignore_bot:
+            bridge.publish(msg)
 
 
 def private_message(sender_sock: socket.socket, recipient_socket: socket.socket, msg: str):
@@ -133,25 +458,130 @@ def private_message(sender_sock: socket.socket, recipient_socket: socket.socket,
     :param msg: str
     :return: None
     """
-    msg = "[{}] -> [{}] {}".format(sockets_list[sender_sock], sockets_list[recipient_socket], msg)
-    logger.info(msg)
+    msg = "[{}] -> [{}] {}".format(participants.name(sender_sock), participants.name(recipient_socket), msg)
+    messages_logger.info(msg)
     send_to_one(recipient_socket, msg)
 
 
 def user_registration(sock: socket.socket, msg: str):
     """
-    Check that username is unique and register this name.
+    Check that username is unique (case-insensitive) and register this name.
     Otherwise, asks for another username.
+    In multi-process mode name is claimed on message bus first, registration is completed when bus answers.
 
     :param sock: socket,
-    :param msg: str, username
+    :param msg: str, username, "/seq <name>" or "/resume <room> <seq> <name>" (see parse_registration)
     :return: None
     """
-    if msg in sockets_list.values():
-        send_to_one(sock, "Name '{}' is not available, please try another one.\n"
-                          "What is your name?".format(msg))
+    if bus is not None and bus.is_claiming(sock):
+        return
+    name, is_sequenced, resume_point = parse_registration(msg)
+    if not name or len(name) > MAX_NAME_LENGTH or not is_name_available(name):
+        name_is_not_available(sock, name or msg.strip())
+        return
+    registration_options[sock] = (is_sequenced, resume_point)
+    if bus is None:
+        register_user(sock, name)
     else:
-        sockets_list[sock] = msg
-        host, port = sock.getpeername()
-        send_to_all('Accepted new connection from {}:{}, username: {}'.format(host, port, msg), sock)
-        send_to_one(sock, "Hi, {}! Welcome to chat room!".format(msg))
+        bus.claim(sock, name)
+
+
+def parse_registration(msg: str) -> Tuple[str, bool, Optional[Tuple[str, int]]]:
+    """
+    Get username from registration message. Client that registers with SEQUENCED_REGISTRATION or
+    RESUME_REGISTRATION gets public messages with sequence numbers, resume point is used by register_user.
+
+    :param msg: str, registration message
+    :return: tuple (username, sequenced, (room, seq) or None), username is "" if message is malformed
+    """
+    words = msg.split()
+    if words[:1] == [SEQUENCED_REGISTRATION]:
+        return msg.strip()[len(SEQUENCED_REGISTRATION):].strip(), True, None
+    if words[:1] == [RESUME_REGISTRATION]:
+        words = msg.split(" ", 3)
+        if len(words) == 4 and ROOM_NAME_PATTERN.match(words[1]) and words[2].isdigit():
+            return words[3].strip(), True, (words[1], int(words[2]))
+        return "", True, None
+    return msg.strip(), False, None
+
+
+def send_last_messages(sock: socket.socket, room: Room, count: int):
+    """
+    Send the last {count} public messages of {room} as one buffer, with sequence numbers if client needs them
+    """
+    count = min(count, MAX_HISTORY_REPLAY, room.history_size())
+    if not count:
+        return
+    frames = room.last_messages(count)
+    if sock in sequenced:
+        frames = add_sequence_numbers(room, room.seq - count + 1, frames)
+    send_data(sock, limit_replay(frames)[1])
+
+
+def limit_replay(frames: bytes) -> Tuple[int, bytes]:
+    """
+    The newest frames that fit into MAX_REPLAY_SIZE, so reply from history never triggers SLOW_CONSUMER_POLICY
+
+    :param frames: bytes, encoded frames from the oldest to the newest one
+    :return: tuple (count of skipped oldest frames, frames that should be sent)
+    """
+    skipped = pos = 0
+    while len(frames) - pos > MAX_REPLAY_SIZE:
+        (size,) = FRAME_HEADER.unpack_from(frames, pos)
+        pos += FRAME_HEADER.size + size
+        skipped += 1
+    return skipped, frames[pos:]
+
+
+def add_sequence_numbers(room: Room, seq: int, frames: bytes) -> bytes:
+    """
+    Encode frames of {room} history again with sequence numbers starting from {seq}
+    """
+    messages = FrameDecoder(max_size=len(frames)).feed(frames)
+    return b"".join(encode_frame(SEQUENCE_PREFIX.format(room.name, seq + i) + msg) for i, msg in enumerate(messages))
+
+
+def is_name_available(name: str) -> bool:
+    """
+    Check that nobody is registered with the same case-insensitive name on this server,
+    other worker processes and linked servers
+    """
+    return (participants.is_available(name) and (bus is None or bus.is_available(name))
+            and (federation is None or federation.is_available(name)))
+
+
+def name_is_not_available(sock: socket.socket, name: str):
+    """
+    Ask for another username
+    """
+    send_to_one(sock, "Name '{}' is not available, please try another one.\n"
+                      "What is your name?".format(name))
+
+
+def register_user(sock: socket.socket, name: str):
+    """
+    Register username, user joins the default room and gets the last public messages of this room.
+    Resumed client joins its previous room and gets messages after its resume point instead
+    (the newest of them if they don't fit into MAX_HISTORY_REPLAY and MAX_REPLAY_SIZE).
+
+    :param sock: socket,
+    :param name: str, unique username
+    :return: None
+    """
+    participants.register(sock, name)
+    if federation is not None:
+        federation.user_joined(name)
+    is_sequenced, resume_point = registration_options.pop(sock, (False, None))
+    if is_sequenced:
+        sequenced.add(sock)
+    room_name, seq = resume_point or (DEFAULT_ROOM, None)
+    room = rooms.join(sock, room_name)
+    host, port = sock.getpeername()
+    send_to_room(room, 'Accepted new connection from {}:{}, username: {}'.format(host, port, name), sock)
+    send_to_one(sock, "Hi, {}! Welcome to chat room!".format(name))
+    if seq is None:
+        send_last_messages(sock, room, HISTORY_REPLAY_COUNT)
+        return
+    seq, frames = room.messages_after(seq, MAX_HISTORY_REPLAY)
+    if frames:
+        send_data(sock, limit_replay(add_sequence_numbers(room, seq, frames))[1])  # missed messages in one batch
@@ -0,0 +1,255 @@
+"""
+Federation of chat servers
+
+Several servers (on different hosts or ports) form one logical chat: public messages, private messages
+and lists of participants span all linked nodes. Every node listens for peer connections on CHAT_PEER_PORT
+and connects to nodes from CHAT_PEERS, peers should be linked directly with each other (full mesh).
+
+Peer link uses the same events as message bus (see cluster.py):
+    - events produced during one iteration of event loop are sent to peer together
+    - every event has id of its origin node and sequence number, so duplicates are dropped
+      (i.e. when two nodes connected to each other from both sides)
+    - after connecting, nodes send "hello" event with their users, it replaces users of this node
+
+Start:
+    CHAT_PEER_PORT=9888 python server.py 127.0.0.1 8888
+    CHAT_PEER_PORT=9889 CHAT_PEERS=127.0.0.1:9888 python server.py 127.0.0.1 8889
+"""
+import errno
+import logging
+import os
+import selectors
+import socket
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+import common
+from cluster import Link
+from scheduler import ScheduledCall
+
+logger = logging.getLogger('chat_logger')
+
+PEER_PORT = int(os.environ.get("CHAT_PEER_PORT", "0"))  # port for connections from other nodes, 0 - don't listen
+PEERS = [(peer.rsplit(":", 1)[0], int(peer.rsplit(":", 1)[1]))
+         for peer in os.environ.get("CHAT_PEERS", "").split(",") if peer]  # host:port of nodes to connect to
+RECONNECT_INTERVAL = 1.0  # seconds between attempts to connect to peer that is not available
+
+
+class Federation:
+    """
+    Links of this node to other nodes + directory of users connected to other nodes
+    """
+
+    def __init__(self, port: int, peers: List[Tuple[str, int]]):
+        self.node_id = uuid.uuid4().hex  # new id after restart, so sequence numbers can start from the beginning
+        self.seq = 0
+        self.last_seq: Dict[str, int] = {}  # node id -> sequence number of the last received event
+        self.links: Dict[socket.socket, Link] = {}
+        self.link_nodes: Dict[Link, str] = {}  # node id of link, known after hello
+        self.users: Dict[str, Dict[str, str]] = {}  # node id -> casefolded name -> name
+        self.outgoing: Dict[Tuple[str, int], Optional[socket.socket]] = {peer: None for peer in peers}
+        self.connecting: Dict[socket.socket, Tuple[str, int]] = {}
+        self.reconnect_call: Optional[ScheduledCall] = None
+        self.listener = None
+        if port:
+            self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.listener.bind(("", port))
+            self.listener.listen()
+            self.listener.setblocking(False)
+            common.selector.register(self.listener, selectors.EVENT_READ)
+        self.connect_peers()
+
+    def __contains__(self, sock: socket.socket) -> bool:
+        return sock is self.listener or sock in self.links or sock in self.connecting
+
+    def names(self) -> List[str]:
+        """
+        Usernames of users connected to other nodes
+        """
+        return [name for users in self.users.values() for name in users.values()]
+
+    def is_available(self, name: str) -> bool:
+        """
+        Check that nobody is registered with the same case-insensitive name on other nodes
+        """
+        return all(name.casefold() not in users for users in self.users.values())
+
+    def send_event(self, event: dict, links: List[Link]):
+        """
+        Add origin and sequence number to event and send it to {links}
+        """
+        self.seq += 1
+        event["node"] = self.node_id
+        event["seq"] = self.seq
+        for link in links:
+            link.send(event)
+
+    def publish(self, room: str, msg: str, to_history: bool):
+        """
+        Send public message to members of {room} on other nodes
+        """
+        self.send_event({"type": "room", "room": room, "msg": msg, "history": to_history}, list(self.links.values()))
+
+    def send_private(self, name: str, msg: str) -> bool:
+        """
+        Send private message to user of another node
+
+        :return: bool, False if there is no such user
+        """
+        for node_id, users in self.users.items():
+            if name.casefold() in users:
+                links = [link for link, link_node in self.link_nodes.items() if link_node == node_id]
+                self.send_event({"type": "private", "to": users[name.casefold()], "msg": msg}, links)
+                return True
+        return False
+
+    def user_joined(self, name: str):
+        """
+        Notify other nodes about new user of this node
+        """
+        self.send_event({"type": "joined", "name": name}, list(self.links.values()))
+
+    def user_left(self, name: str):
+        """
+        Notify other nodes about disconnected user of this node
+        """
+        self.send_event({"type": "left", "name": name}, list(self.links.values()))
+
+    def add_link(self, sock: socket.socket):
+        """
+        Start using connected socket as peer link, send users of this node to peer
+        """
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        link = self.links[sock] = Link(sock, common.selector)
+        users = [name for name in common.participants.names()
+                 if common.participants.get_socket(name) is not common.server_socket]
+        self.send_event({"type": "hello", "users": users}, [link])
+
+    def remove_link(self, link: Link):
+        """
+        Close broken link, users of its node are removed if there are no other links to this node
+        """
+        del self.links[link.sock]
+        node_id = self.link_nodes.pop(link, None)
+        if node_id is not None and node_id not in self.link_nodes.values():
+            self.users.pop(node_id, None)
+            logger.info("Node {} was disconnected".format(node_id))
+        for peer, sock in self.outgoing.items():
+            if sock is link.sock:
+                self.outgoing[peer] = None
+                self.schedule_reconnect()
+        link.close()
+
+    def schedule_reconnect(self):
+        """
+        Connect to peers that are not connected after RECONNECT_INTERVAL
+        """
+        if self.reconnect_call is None:
+            self.reconnect_call = common.scheduler.call_later(RECONNECT_INTERVAL, self.connect_peers)
+
+    def connect_peers(self):
+        """
+        Start non-blocking connections to peers that are not connected
+        """
+        self.reconnect_call = None
+        for peer, sock in self.outgoing.items():
+            if sock is None:
+                sock = self.outgoing[peer] = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.setblocking(False)
+                error = sock.connect_ex(peer)
+                if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    sock.close()
+                    self.outgoing[peer] = None
+                    self.schedule_reconnect()
+                    continue
+                self.connecting[sock] = peer
+                common.selector.register(sock, selectors.EVENT_WRITE)
+
+    def connected(self, sock: socket.socket):
+        """
+        Non-blocking connection to peer was completed or failed
+        """
+        peer = self.connecting.pop(sock)
+        common.selector.unregister(sock)
+        if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+            sock.close()
+            self.outgoing[peer] = None
+            self.schedule_reconnect()
+        else:
+            self.add_link(sock)
+
+    def accept(self):
+        """
+        Accept connections from other nodes
+        """
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except BlockingIOError:
+                return
+            sock.setblocking(False)
+            self.add_link(sock)
+
+    def is_new(self, event: dict) -> bool:
+        """
+        Check that event was not received before via another link
+        """
+        if event["node"] == self.node_id or event["seq"] <= self.last_seq.get(event["node"], 0):
+            return False
+        self.last_seq[event["node"]] = event["seq"]
+        return True
+
+    def receive(self, link: Link) -> List[dict]:
+        """
+        Read events from peer, user directory is updated here, other events are returned to server
+        """
+        events = []
+        for event in link.receive():
+            node_id = event["node"]
+            if event["type"] == "hello":
+                self.link_nodes[link] = node_id
+            if not self.is_new(event):
+                continue
+            if event["type"] == "hello":
+                self.users[node_id] = {name.casefold(): name for name in event["users"]}
+            elif event["type"] == "joined":
+                self.users.setdefault(node_id, {})[event["name"].casefold()] = event["name"]
+            elif event["type"] == "left":
+                self.users.get(node_id, {}).pop(event["name"].casefold(), None)
+            else:
+                events.append(event)
+        return events
+
+    def process(self, sock: socket.socket, mask: int) -> List[dict]:
+        """
+        Process selector event of federation socket
+
+        :param sock: socket, listener, connecting socket or peer link
+        :param mask: selector event mask
+        :return: list of events that should be processed by server (room and private messages)
+        """
+        if sock is self.listener:
+            self.accept()
+        elif sock in self.connecting:
+            self.connected(sock)
+        else:
+            link = self.links[sock]
+            try:
+                if mask & selectors.EVENT_WRITE:
+                    link.flush()
+                if mask & selectors.EVENT_READ:
+                    return self.receive(link)
+            except ConnectionError:
+                self.remove_link(link)
+        return []
+
+    def flush(self):
+        """
+        Send events of this loop iteration to peers
+        """
+        for link in list(self.links.values()):
+            try:
+                link.flush()
+            except ConnectionError:
+                self.remove_link(link)
@@ -0,0 +1,41 @@
+"""
+Registry of games that can be started by [server] <game> command
+
+Game modules are imported on the first start of the game, so server starts without loading them.
+To add a game: create module with function that starts game (sock, arguments of command) and add it to GAMES.
+Messages of players are passed to function (sock, msg) of GameSession while game is active.
+"""
+import importlib
+from typing import Callable, Dict
+
+GAMES = {"rock-paper-scissors": "games.game_rock_paper_scissors:start_game",
+         "21": "games.game_21:start_game",
+         "quiz": "games.game_quiz:start_game"}  # command -> module:function
+loaded_games: Dict[str, Callable] = {}  # command -> imported function that starts game
+
+
+class GameSession:
+    """
+    Progress of one game, games keep their state in subclasses with __slots__
+    """
+    __slots__ = ("game",)
+
+    def __init__(self, game: Callable):
+        """
+        :param game: function that processes messages of players (sock, msg)
+        """
+        self.game = game
+
+
+def get_game(name: str) -> Callable:
+    """
+    Function that starts game by command name, its module is imported on the first call
+
+    :param name: str, command from GAMES
+    :return: function (sock, arguments)
+    """
+    game = loaded_games.get(name)
+    if game is None:
+        module_name, function_name = GAMES[name].split(":")
+        game = loaded_games[name] = getattr(importlib.import_module(module_name), function_name)
+    return game
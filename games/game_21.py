@@ -5,6 +5,20 @@ import random
 import socket
 from typing import Tuple
 import common
+from games import GameSession
+
+
+class Game21Session(GameSession):
+    """
+    Progress of 21 game
+    """
+    __slots__ = ("status", "player", "server")
+
+    def __init__(self):
+        super().__init__(one_player_game_21)
+        self.status = "throwing_for_player"  # or throwing_for_server
+        self.player = 0  # player score
+        self.server = 0  # server score
 
 
 def init_new_game(sock: socket.socket):
@@ -18,10 +32,14 @@ def init_new_game(sock: socket.socket):
                            "Let's play 21!\nYou and server will throw numbers from 0 to 10 and calculate them.\n"
                            "Your goal: score as much as possible, but not more than 21.\n"
                            "Throwing out for you (need to send: number from 0 to 10 or 'stop')")
-    common.one_player_game_list[sock] = {"game": one_player_game_21,
-                                         "status": "throwing_for_player",
-                                         "player": 0,
-                                         "server": 0}
+    common.one_player_game_list[sock] = Game21Session()
+
+
+def start_game(sock: socket.socket, _: str):
+    """
+    Start 21 with user of {sock}
+    """
+    init_new_game(sock)
 
 
 def server_choice(player_score: int, server_score: int, is_throwing_for_player: bool) -> int:
@@ -52,17 +70,18 @@ def one_round(sock: socket.socket, msg: str) -> Tuple[int, int, int, int]:
     :param msg: str, client choice (numbers [0..10])
     :return: (int, int, int, int) - player and server choices, player and server scores
     """
-    player_score = common.one_player_game_list[sock]["player"]
-    server_score = common.one_player_game_list[sock]["server"]
+    session = common.one_player_game_list[sock]
+    player_score = session.player
+    server_score = session.server
     player = int(msg)
-    is_throwing_for_player = common.one_player_game_list[sock]["status"] == "throwing_for_player"
+    is_throwing_for_player = session.status == "throwing_for_player"
     server = server_choice(player_score, server_score, is_throwing_for_player)
     if is_throwing_for_player:
         player_score += player + server
     else:
         server_score += player + server
-    common.one_player_game_list[sock]["player"] = player_score
-    common.one_player_game_list[sock]["server"] = server_score
+    session.player = player_score
+    session.server = server_score
     return player, server, player_score, server_score
 
 
@@ -79,7 +98,7 @@ def round_response(sock: socket.socket, player: int, server: int, player_score:
     """
     response = "You thrown {}, server thrown {}. Total: you - {}, server - {}\n" \
         .format(player, server, player_score, server_score)
-    if common.one_player_game_list[sock]["status"] == "throwing_for_player":
+    if common.one_player_game_list[sock].status == "throwing_for_player":
         if player_score < 21:
             response += "Throwing out for you (need to send: number from 0 to 10 or 'stop')"
         else:
@@ -112,8 +131,9 @@ def one_player_game_21(sock: socket.socket, msg: str):
     if msg == common.INIT_GAME_MSG:
         init_new_game(sock)
     else:
-        if "stop" in msg and common.one_player_game_list[sock]["status"] == "throwing_for_player":
-            common.one_player_game_list[sock]["status"] = "throwing_for_server"
+        session = common.one_player_game_list[sock]
+        if "stop" in msg and session.status == "throwing_for_player":
+            session.status = "throwing_for_server"
             response = "Throwing out for server (need to send: number from 0 to 10)"
         else:
             if msg.isdigit() and int(msg) < 11:
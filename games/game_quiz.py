@@ -1,83 +1,152 @@
 """
 Quiz: all players game
+
+Every room can have its own quiz round, public messages of room members are answers while the round is running.
+Questions are taken from question bank (see questions.py), questions are not repeated in the room
+until all questions of the category were asked.
 """
-# pylint: disable=C0103     # UPPER_CASE naming style
-# pylint: disable=W0603     # global statement
-import random
+import atexit
 import socket
-from typing import Optional
-from threading import Timer
+from typing import Dict, List, Tuple
 import common
+from games import GameSession
+from games.questions import QUESTIONS_PATH, Deck, Question, QuestionBank, normalize
+from scheduler import ScheduledCall
+
+QUIZ_DURATION = 30      # seconds for answers
+TYPO_EVERY = 5          # one typo is allowed for every 5 characters of right answer ("equal" comparison)
+
+question_bank = QuestionBank(QUESTIONS_PATH)
+atexit.register(question_bank.close)
+decks: Dict[Tuple[str, str], Deck] = {}  # (room name, category) -> order of questions in the room
+
+
+class QuizSession(GameSession):
+    """
+    Progress of quiz round in one room
+    """
+    __slots__ = ("question", "winner", "answers", "finish")
 
-questions = [("How many bytes in one kilobyte?", "1024", "equal"),
-             ("What is the capital of Belarus?", "Minsk", "equal"),
-             ("Who is the creator of the Python?", "Guido", "contains")]
-_answer: str            # right answer on the current question
-_comparison: str        # how to compare user answer and right one (equal, contains)
-_winner: Optional[str]  # quiz winner
-_log: str               # log of user answers
+    def __init__(self, question: Question, finish: ScheduledCall):
+        """
+        :param question: Question, the current question
+        :param finish: ScheduledCall, end of the round
+        """
+        super().__init__(all_players_game_quiz)
+        self.question = question
+        self.winner = None
+        self.answers: List[str] = []   # log of user answers, it is joined once at the end of the round
+        self.finish = finish
 
 
-def init_new_game():
+def start_game(sock: socket.socket, category: str):
     """
-    Initialization game parameters, send question to users and start timer
+    Start quiz in the room of {sock}, see all_players_game_quiz
+
+    :param sock: socket, client socket that started game
+    :param category: str, category of questions, any category if it is empty
+    :return: None
     """
-    global _answer, _comparison, _winner, _log
-    question, _answer, _comparison = random.choice(questions)
-    _winner = None
-    _log = ""
-    common.send_to_all(f"Let's start Quiz round!\nYou have 30 sec and you can send several answers\n{question}")
-    common.all_player_game["game"] = all_players_game_quiz
-    Timer(30, all_players_game_quiz, [None, common.STOP_GAME_MSG]).start()
+    init_new_game(sock, category)
 
 
-def is_right_answer(answer: str):
+def init_new_game(sock: socket.socket, category: str = ""):
+    """
+    Initialization game parameters in the room of {sock}, send question to room members
+    and schedule the end of the round
+    """
+    room = common.rooms.room_of(sock)
+    if room.name in common.all_player_games:
+        common.private_message(common.server_socket, sock, "Quiz is already running in this room")
+        return
+    numbers = question_bank.category_range(category)
+    if numbers is None:
+        common.private_message(common.server_socket, sock, "There are no questions{}. Categories: {}".format(
+            " in category '{}'".format(category) if category else "", ", ".join(question_bank.categories)))
+        return
+    key = (room.name, category.casefold())
+    if key not in decks:
+        decks[key] = Deck(*numbers)
+    question = question_bank.question(decks[key].draw())
+    finish = common.scheduler.call_later(QUIZ_DURATION, finish_game, room.name)
+    common.all_player_games[room.name] = QuizSession(question, finish)
+    common.send_to_room(room, f"Let's start Quiz round!\nYou have {QUIZ_DURATION} sec and you can send several "
+                              f"answers\n{question.text}")
+
+
+def is_similar(answer: str, right_answer: str, max_typos: int) -> bool:
+    """
+    Check that Levenshtein distance between answers is not more than {max_typos}.
+    Only cells of the diagonal band |i - j| <= max_typos can be within limit, calculation stops
+    as soon as all cells of the row are over limit.
+    """
+    if abs(len(answer) - len(right_answer)) > max_typos:
+        return False
+    over_limit = max_typos + 1
+    previous = list(range(len(right_answer) + 1))
+    for i, char in enumerate(answer, 1):
+        current = [i] + [over_limit] * len(right_answer)
+        for j in range(max(1, i - max_typos), min(len(right_answer), i + max_typos) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != right_answer[j - 1]))
+        if min(current) > max_typos:
+            return False
+        previous = current
+    return previous[-1] <= max_typos
+
+
+def is_right_answer(session: QuizSession, answer: str):
     """
     Check if user answer is correct.
-    _comparison can have values:
-        - equal - the answer must strictly correspond to the correct one
-        - contains - the answer must contain the correct one
+    session.question.comparison can have values:
+        - equal - the answer must correspond to one of the right answers,
+                  one typo is allowed for every TYPO_EVERY characters (i.e. "Gvido" for "Guido")
+        - contains - the answer must contain one of the right answers
                      (i.e. "Guido", "Guido van Rossum" are both correct if right answer is "Guido")
+    Answers are compared case-insensitively, right answers are normalized once per question.
+
+    :param session: QuizSession, progress of quiz
     :param answer: str, user answer
     :return: None
     """
-    if _comparison == "equal":
-        return _answer.lower() == answer.lower()
-    return _answer.lower() in answer.lower()    # _comparison = "contains"
+    answer = normalize(answer)
+    right_answers = session.question.normalized_answers
+    if session.question.comparison == "contains":
+        return any(right_answer in answer for right_answer in right_answers)
+    if answer in right_answers:
+        return True
+    return any(is_similar(answer, right_answer, len(right_answer) // TYPO_EVERY)
+               for right_answer in right_answers if len(right_answer) >= TYPO_EVERY)
 
 
-def finish_game():
+def finish_game(room_name: str):
     """
-    Send result messages and remove game
+    Send result messages to room members and remove game
     """
-    if len(_log) > 0:
-        response = "Participants' answer(s):\n{}The right answer: {}\n".format(_log, _answer)
-        if _winner is None:
+    session = common.all_player_games.pop(room_name)
+    common.scheduler.cancel(session.finish)
+    if session.answers:
+        response = "Participants' answer(s):\n{}\nThe right answer: {}\n".format("\n".join(session.answers),
+                                                                                  session.question.answer)
+        if session.winner is None:
             response += "No winner!"
         else:
-            response += "The winner is {}! Congratulations!".format(_winner)
+            response += "The winner is {}! Congratulations!".format(session.winner)
     else:
         response = "Nobody sent an answer. No winner!"
-    common.send_to_all(response)
-    common.all_player_game.clear()
+    room = common.rooms.by_name.get(room_name)
+    if room is not None:    # everybody could leave the room during the round, it should not be created again
+        common.send_to_room(room, response)
 
 
-def all_players_game_quiz(sock: Optional[socket.socket], msg: str):
+def all_players_game_quiz(sock: socket.socket, msg: str):
     """
     Game: Quiz (all players game)
 
     :param sock: socket, client socket that is playing game
-    :param msg: str, client answer
+    :param msg: str, client answer, round is started by start_game and finished by scheduler
     :return: None
     """
-    global _winner, _log
-    if msg == common.INIT_GAME_MSG:
-        init_new_game()
-    elif sock is None:
-        raise ValueError("sock=None is allowed only with init message, but message is {}".format(msg))
-    elif msg == common.STOP_GAME_MSG:
-        finish_game()
-    else:
-        _log += "[{}] {}\n".format(common.sockets_list[sock], msg)
-        if _winner is None and is_right_answer(msg):
-            _winner = common.sockets_list[sock]
+    session = common.all_player_games[common.rooms.room_of(sock).name]
+    session.answers.append("[{}] {}".format(common.participants.name(sock), msg))
+    if session.winner is None and is_right_answer(session, msg):
+        session.winner = common.participants.name(sock)
@@ -4,6 +4,7 @@ Rock-paper-scissors: one player game with server
 import random
 import socket
 import common
+from games import GameSession
 
 reductions = {"r": "rock", "p": "paper", "s": "scissors"}
 WIN_MSG = "You won!"
@@ -13,6 +14,13 @@ rules = {"rs": WIN_MSG, "rp": LOSE_MSG,
          "sp": WIN_MSG, "sr": LOSE_MSG}
 
 
+def start_game(sock: socket.socket, _: str):
+    """
+    Start rock-paper-scissors with user of {sock}
+    """
+    one_player_game_rock_paper_scissors(sock, common.INIT_GAME_MSG)
+
+
 def one_player_game_rock_paper_scissors(sock: socket.socket, msg: str):
     """
     Game: rock-paper-scissors
@@ -25,7 +33,7 @@ def one_player_game_rock_paper_scissors(sock: socket.socket, msg: str):
         common.private_message(common.server_socket, sock,
                                "Let's play rock-paper-scissors!\nWhat is your choice?"
                                " (need to send: rock or r / paper or p /scissors or s)")
-        common.one_player_game_list[sock] = {"game": one_player_game_rock_paper_scissors}
+        common.one_player_game_list[sock] = GameSession(one_player_game_rock_paper_scissors)
     else:
         if msg in ["rock", "r", "paper", "p", "scissors", "s"]:
             msg = reductions.get(msg, msg)
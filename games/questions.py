@@ -0,0 +1,196 @@
+"""
+Question bank of quiz
+
+Questions are kept in JSON Lines file, one question per line:
+    {"question": "What is the capital of Belarus?", "answer": "Minsk", "category": "geography"}
+"comparison" (equal or contains, see game_quiz.is_right_answer), "alternatives" (list of other right answers)
+and "category" are optional.
+
+Bank is not loaded to memory. Index file {bank}.idx has offsets of lines sorted by category, so every category
+is a range of question numbers. Index is built on the first use and rebuilt when bank file is changed,
+questions are read from memory-mapped bank file only when they are asked.
+"""
+import json
+import logging
+import math
+import mmap
+import os
+import random
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger('chat_logger')
+
+QUESTIONS_PATH = os.environ.get("CHAT_QUIZ_QUESTIONS",
+                                os.path.join(os.path.dirname(os.path.abspath(__file__)), "questions.jsonl"))
+DEFAULT_CATEGORY = "general"  # category of questions without it
+
+
+def normalize(text: str) -> str:
+    """
+    Text for comparing answers: case-insensitive, without extra whitespaces
+    """
+    return " ".join(text.casefold().split())
+
+
+class Question:
+    """
+    Question with precomputed normalized answers
+    """
+    __slots__ = ("text", "answer", "comparison", "category", "normalized_answers")
+
+    def __init__(self, text: str, answer: str, comparison: str, category: str, alternatives: Sequence[str] = ()):
+        self.text = text
+        self.answer = answer
+        self.comparison = comparison
+        self.category = category
+        self.normalized_answers = tuple(dict.fromkeys(normalize(right_answer)  # without duplicates, in the same order
+                                                      for right_answer in (answer, *alternatives)))
+
+
+class Deck:
+    """
+    Endless sequence of numbers from range, numbers are not repeated until all of them are drawn.
+    Order is defined by random first number and random step coprime with count, so deck does not keep
+    shuffled list and uses the same memory for any count of questions.
+    """
+    __slots__ = ("start", "count", "first", "step", "drawn")
+
+    def __init__(self, start: int, stop: int):
+        self.start = start
+        self.count = stop - start
+        self.first = self.step = self.drawn = 0
+        self.shuffle()
+
+    def shuffle(self):
+        """
+        Start new pass over the range in new order
+        """
+        self.first = random.randrange(self.count)
+        self.step = random.randrange(1, self.count) if self.count > 1 else 1
+        while math.gcd(self.step, self.count) != 1:
+            self.step = random.randrange(1, self.count)
+        self.drawn = 0
+
+    def draw(self) -> int:
+        """
+        Next number
+        """
+        if self.drawn == self.count:
+            self.shuffle()
+        number = self.start + (self.first + self.drawn * self.step) % self.count
+        self.drawn += 1
+        return number
+
+
+class QuestionBank:
+    """
+    Indexed file with questions
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.categories: Dict[str, Tuple[int, int]] = {}  # category -> range of question numbers
+        self.offsets = array("Q")  # start and end offsets of lines with questions
+        self.bank_map: Optional[mmap.mmap] = None
+        self.loaded = False
+
+    def __len__(self) -> int:
+        self.load()
+        return len(self.offsets) // 2
+
+    def load(self):
+        """
+        Read index (build it if it is missing or outdated) and map bank file, it is done once on the first use
+        """
+        if self.loaded:
+            return
+        self.loaded = True
+        if not os.path.exists(self.path):
+            logger.warning("Quiz question bank {} is not found".format(self.path))
+            return
+        stat = os.stat(self.path)
+        if not self.read_index(stat):
+            self.build_index(stat)
+        if stat.st_size:
+            with open(self.path, "rb") as bank_file:
+                self.bank_map = mmap.mmap(bank_file.fileno(), stat.st_size, access=mmap.ACCESS_READ)
+
+    def read_index(self, stat: os.stat_result) -> bool:
+        """
+        Read index file: JSON header line with bank size, mtime and categories + offsets
+
+        :return: bool, False if there is no index for the current version of bank
+        """
+        try:
+            with open(self.index_path, "rb") as index_file:
+                header = json.loads(index_file.readline())
+                if header["size"] != stat.st_size or header["mtime"] != stat.st_mtime_ns:
+                    return False
+                self.offsets.frombytes(index_file.read())
+        except (OSError, ValueError, KeyError):
+            return False
+        self.categories = {category: (start, stop) for category, (start, stop) in header["categories"].items()}
+        return True
+
+    def build_index(self, stat: os.stat_result):
+        """
+        Scan bank file once and save offsets of its lines grouped by category
+        """
+        lines: Dict[str, List[Tuple[int, int]]] = {}
+        with open(self.path, "rb") as bank_file:
+            start = 0
+            for line in bank_file:
+                end = start + len(line.rstrip(b"\r\n"))
+                if line.strip():
+                    try:
+                        category = json.loads(line).get("category", DEFAULT_CATEGORY).casefold()
+                        lines.setdefault(category, []).append((start, end))
+                    except ValueError:
+                        logger.warning("Wrong question in {} at offset {}".format(self.path, start))
+                start += len(line)
+        self.offsets = array("Q")
+        self.categories = {}
+        for category in sorted(lines):
+            self.categories[category] = (len(self.offsets) // 2, len(self.offsets) // 2 + len(lines[category]))
+            for start, end in lines[category]:
+                self.offsets.extend((start, end))
+        header = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "categories": self.categories}
+        try:
+            temp_path = "{}.{}.tmp".format(self.index_path, os.getpid())    # workers can build index at the same time
+            with open(temp_path, "wb") as index_file:
+                index_file.write(json.dumps(header).encode() + b"\n")
+                self.offsets.tofile(index_file)
+            os.replace(temp_path, self.index_path)
+        except OSError as ex:
+            logger.warning("Index of quiz questions is not saved, it will be built again after restart:(\n{}"
+                           .format(ex))
+
+    def category_range(self, category: str = "") -> Optional[Tuple[int, int]]:
+        """
+        Range of question numbers in {category}, all questions if category is empty
+
+        :return: tuple (start, stop) or None if there are no such questions
+        """
+        self.load()
+        if not category:
+            return (0, len(self)) if len(self) else None
+        return self.categories.get(category.casefold())
+
+    def question(self, number: int) -> Question:
+        """
+        Read question from bank file
+        """
+        self.load()
+        entry = json.loads(self.bank_map[self.offsets[2 * number]:self.offsets[2 * number + 1]])
+        return Question(entry["question"], entry["answer"], entry.get("comparison", "equal"),
+                        entry.get("category", DEFAULT_CATEGORY), entry.get("alternatives", ()))
+
+    def close(self):
+        """
+        Release memory map of bank file
+        """
+        if self.bank_map is not None:
+            self.bank_map.close()
+            self.bank_map = None
@@ -0,0 +1,352 @@
+"""
+History of public chat messages
+
+History: the last messages of every room are kept as encoded frames in a small ring buffer, so memory usage
+of room is bounded and the last messages can be sent to client as one buffer without encoding them again.
+Older messages are read from MessageLog if it is enabled.
+
+MessageLog: all messages are saved to append-only segment files, so history survives server restarts.
+Every segment has index file with end offsets of its frames, messages are read by memory-mapping segments.
+fsync is done by background thread, so disk latency never stalls server loop.
+"""
+import logging
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+from bisect import bisect_right
+from collections import deque
+from itertools import islice
+from typing import Deque, List, Optional, Tuple
+
+HISTORY_BUFFER_SIZE = 128 * 1024  # bytes per room, the oldest messages are overwritten when buffer is full
+HISTORY_REPLAY_COUNT = 10  # count of the last messages that are sent to user after registration
+MAX_HISTORY_REPLAY = 1000  # max count of messages that are read from history for one reply
+
+MESSAGE_LOG_DIR = os.environ.get("CHAT_LOG_DIR")  # directory for persistent history, it is disabled if not set
+SEGMENT_SIZE = 16 * 1024 * 1024  # bytes, new segment file is started when the current one is full
+FSYNC_EVERY = 100  # fsync log after this count of messages, 0 - never call fsync (leave it to OS)
+FSYNC_INTERVAL = 1.0  # seconds, fsync log on the first message after this interval even if batch is not full
+INDEX_ENTRY = struct.Struct("=Q")  # end offset of frame in segment
+
+logger = logging.getLogger('chat_logger')
+
+
+class History:
+    """
+    Ring buffer of encoded frames
+    """
+
+    def __init__(self, capacity: int = HISTORY_BUFFER_SIZE):
+        self.capacity = capacity
+        self.buffer = bytearray()  # grows up to capacity, rooms with few messages use only memory they need
+        self.entries: Deque[Tuple[int, int]] = deque()  # (offset in buffer, frame size) from the oldest frame
+        self.end = 0  # offset where the next frame will be written
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def append(self, frame: bytes):
+        """
+        Save frame, the oldest frames are dropped if there is not enough space.
+        Frame is never split: if it does not fit at the end of buffer, it is written from the beginning.
+
+        :param frame: bytes, encoded message
+        :return: None
+        """
+        size = len(frame)
+        if size > self.capacity:
+            return
+        start = self.end if self.end + size <= self.capacity else 0
+        while self.entries:
+            oldest = self.entries[0][0]
+            # drop frames that will be overwritten + frames at the end of buffer after wrapping around
+            if start <= oldest < start + size or start < self.end <= oldest:
+                self.entries.popleft()
+            else:
+                break
+        self.buffer[start:start + size] = frame     # buffer is extended if frame is written after its end
+        self.entries.append((start, size))
+        self.end = start + size
+
+    def last(self, count: int) -> bytes:
+        """
+        The last {count} frames as one buffer
+
+        :param count: int, count of messages
+        :return: bytes, encoded frames from the oldest to the newest one
+        """
+        entries = list(islice(reversed(self.entries), count))
+        entries.reverse()
+        view = memoryview(self.buffer)
+        chunks = []
+        run_start = run_end = 0
+        for start, size in entries:
+            if start != run_end:     # frames are adjacent in buffer unless buffer was wrapped around
+                chunks.append(view[run_start:run_end])
+                run_start = start
+            run_end = start + size
+        chunks.append(view[run_start:run_end])
+        return b"".join(chunks)
+
+
+class Segment:
+    """
+    One segment of message log: {base:020}.log with frames and {base:020}.idx with their end offsets
+    """
+
+    def __init__(self, directory: str, base: int):
+        self.base = base  # number of the first message in segment
+        self.log_path = os.path.join(directory, "{:020}.log".format(base))
+        self.index_path = os.path.join(directory, "{:020}.idx".format(base))
+        self.count = 0
+        self.size = 0
+        self.maps: Optional[Tuple[mmap.mmap, memoryview]] = None  # (log, index) maps, valid while count is the same
+        self.mapped_count = 0
+
+    def load(self):
+        """
+        Read count of messages and size from index file, drop data that was not completely written
+        """
+        index_size = os.path.getsize(self.index_path) if os.path.exists(self.index_path) else 0
+        log_size = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+        self.count = index_size // INDEX_ENTRY.size
+        self.size = 0
+        with open(self.index_path, "ab+") as index_file:
+            while self.count:
+                index_file.seek((self.count - 1) * INDEX_ENTRY.size)
+                (self.size,) = INDEX_ENTRY.unpack(index_file.read(INDEX_ENTRY.size))
+                if self.size <= log_size:
+                    break
+                self.count -= 1
+                self.size = 0
+            index_file.truncate(self.count * INDEX_ENTRY.size)
+        with open(self.log_path, "ab+") as log_file:
+            log_file.truncate(self.size)
+
+    def mapped(self) -> Tuple[mmap.mmap, memoryview]:
+        """
+        Memory-mapped log and index of the segment
+        """
+        if self.maps is None or self.mapped_count != self.count:
+            self.close()
+            with open(self.log_path, "rb") as log_file, open(self.index_path, "rb") as index_file:
+                log_map = mmap.mmap(log_file.fileno(), self.size, access=mmap.ACCESS_READ)
+                index_map = mmap.mmap(index_file.fileno(), self.count * INDEX_ENTRY.size, access=mmap.ACCESS_READ)
+            self.maps = (log_map, memoryview(index_map).cast("Q"))
+            self.mapped_count = self.count
+        return self.maps
+
+    def frames(self, start: int, stop: int) -> bytes:
+        """
+        Frames from {start} to {stop} (numbers inside segment), they are adjacent in log file
+        """
+        if start >= stop:
+            return b""
+        log_map, ends = self.mapped()
+        return log_map[ends[start - 1] if start else 0:ends[stop - 1]]
+
+    def search(self, needle: bytes, limit: int) -> List[bytes]:
+        """
+        Find the last {limit} frames containing {needle}, from the newest to the oldest one
+        """
+        log_map, ends = self.mapped()
+        found = []
+        end = self.size
+        while len(found) < limit:
+            pos = log_map.rfind(needle, 0, end)
+            if pos < 0:
+                break
+            i = bisect_right(ends, pos)
+            frame_start = ends[i - 1] if i else 0
+            if pos + len(needle) <= ends[i]:
+                found.append(log_map[frame_start:ends[i]])
+            end = frame_start
+        return found
+
+    def close(self):
+        """
+        Release memory maps
+        """
+        if self.maps is not None:
+            log_map, ends = self.maps
+            index_map = ends.obj
+            ends.release()
+            index_map.close()
+            log_map.close()
+            self.maps = None
+
+
+class Syncer:
+    """
+    Background thread that calls fsync for files of message logs.
+    Files are synced via duplicated descriptors, so they can be closed (i.e. on segment roll) before fsync is done.
+    """
+
+    def __init__(self):
+        self.descriptors: queue.Queue = queue.Queue()
+        self.thread: Optional[threading.Thread] = None
+
+    def sync(self, *files):
+        """
+        Schedule fsync of {files}, data should be already flushed to OS
+        """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.syncing_loop, name="log-sync", daemon=True)
+            self.thread.start()
+        for file in files:
+            self.descriptors.put(os.dup(file.fileno()))
+
+    def syncing_loop(self):
+        """
+        fsync descriptors one by one
+        """
+        while True:
+            descriptor = self.descriptors.get()
+            try:
+                os.fsync(descriptor)
+            except OSError as ex:
+                logger.error("Message log was not synced to disk:(\n{}".format(ex))
+            finally:
+                os.close(descriptor)
+                self.descriptors.task_done()
+
+    def wait(self):
+        """
+        Wait until all scheduled fsync calls are done
+        """
+        self.descriptors.join()
+
+
+syncer = Syncer()
+
+
+class MessageLog:
+    """
+    Append-only log of encoded frames split into segments.
+    Only index sizes are read on startup, messages are read from memory-mapped segments on request.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        bases = sorted(int(name[:-len(".log")]) for name in os.listdir(directory) if name.endswith(".log"))
+        self.segments: List[Segment] = [Segment(directory, base) for base in bases or [0]]
+        self.segments[-1].load()
+        for segment in self.segments[:-1]:
+            segment.count = os.path.getsize(segment.index_path) // INDEX_ENTRY.size
+            segment.size = os.path.getsize(segment.log_path)
+        self.log_file = open(self.segments[-1].log_path, "ab")  # pylint: disable=R1732     # open until close()
+        self.index_file = open(self.segments[-1].index_path, "ab")  # pylint: disable=R1732     # open until close()
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return self.segments[-1].base + self.segments[-1].count
+
+    def append(self, frame: bytes):
+        """
+        Write frame to the current segment.
+        Data is buffered until flush, so many messages are written to OS together.
+
+        :param frame: bytes, encoded message
+        :return: None
+        """
+        segment = self.segments[-1]
+        if segment.count and segment.size + len(frame) > SEGMENT_SIZE:
+            segment = self.new_segment()
+        self.log_file.write(frame)
+        segment.size += len(frame)
+        self.index_file.write(INDEX_ENTRY.pack(segment.size))
+        segment.count += 1
+
+        self.unsynced += 1
+
+    def flush(self) -> bool:
+        """
+        Write buffered data to OS, it survives server crash after that.
+        fsync is done in batches (see FSYNC_EVERY and FSYNC_INTERVAL), so data survives OS crash too.
+
+        :return: bool, True if there are messages that are not synced yet, flush should be called again
+            after FSYNC_INTERVAL even if there are no new messages
+        """
+        if not self.unsynced:
+            return False
+        if FSYNC_EVERY and (self.unsynced >= FSYNC_EVERY or time.monotonic() - self.synced_at >= FSYNC_INTERVAL):
+            self.sync()
+        else:
+            self.log_file.flush()
+            self.index_file.flush()
+        return bool(FSYNC_EVERY and self.unsynced)
+
+    def new_segment(self) -> Segment:
+        """
+        Close files of the current segment and start the next one
+        """
+        self.sync()
+        self.log_file.close()
+        self.index_file.close()
+        segment = Segment(self.directory, len(self))
+        self.segments.append(segment)
+        self.log_file = open(segment.log_path, "ab")  # pylint: disable=R1732     # open until close()
+        self.index_file = open(segment.index_path, "ab")  # pylint: disable=R1732     # open until close()
+        return segment
+
+    def sync(self):
+        """
+        Flush written data to OS and fsync it to disk in background thread
+        """
+        self.log_file.flush()
+        self.index_file.flush()
+        if FSYNC_EVERY:
+            syncer.sync(self.log_file, self.index_file)
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def frames(self, start: int, stop: int) -> bytes:
+        """
+        Frames of messages from {start} to {stop} (numbers from the beginning of log) as one buffer
+        """
+        self.log_file.flush()
+        self.index_file.flush()
+        chunks = []
+        first = max(bisect_right([segment.base for segment in self.segments], start) - 1, 0)
+        for segment in self.segments[first:]:
+            if segment.base >= stop:
+                break
+            chunks.append(segment.frames(max(start - segment.base, 0), min(stop - segment.base, segment.count)))
+        return b"".join(chunks)
+
+    def last(self, count: int) -> bytes:
+        """
+        The last {count} frames as one buffer
+        """
+        return self.frames(max(len(self) - count, 0), len(self))
+
+    def search(self, text: str, limit: int) -> List[bytes]:
+        """
+        The last {limit} frames that contain {text}, from the oldest to the newest one
+        """
+        self.log_file.flush()
+        self.index_file.flush()
+        found: List[bytes] = []
+        for segment in reversed(self.segments):
+            if segment.count:
+                found += segment.search(text.encode(), limit - len(found))
+            if len(found) >= limit:
+                break
+        found.reverse()
+        return found
+
+    def close(self):
+        """
+        Sync and close log files
+        """
+        self.sync()
+        syncer.wait()
+        self.log_file.close()
+        self.index_file.close()
+        for segment in self.segments:
+            segment.close()
@@ -0,0 +1,108 @@
+"""
+Logging handlers and formatters that can be used in logging.conf
+
+AsyncStreamHandler: records are put to queue and written to stream by background thread in batches,
+so slow terminal or pipe never blocks chat loop. Records of MESSAGES_LOGGER (content of chat messages)
+can be sampled.
+
+JsonFormatter: one JSON object per line (time, level, logger, message).
+"""
+import json
+import logging
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+
+MESSAGES_LOGGER = "chat_logger.messages"  # logger for content of chat messages
+BATCH_SIZE = 1000  # max count of records written to stream at once
+
+
+class AsyncStreamHandler(logging.Handler):
+    """
+    Handler that writes formatted records to stream in background thread.
+    If stream is too slow and queue is full, new records are dropped and counted.
+    """
+
+    def __init__(self, stream=None, queue_size: int = 10000, sample_rate: float = 1.0):
+        """
+        :param stream: stream, sys.stderr by default
+        :param queue_size: int, max count of records waiting for writing
+        :param sample_rate: float, part of MESSAGES_LOGGER records that are logged (1.0 - all, 0.1 - every 10th)
+        """
+        super().__init__()
+        self.stream = stream if stream is not None else sys.stderr
+        self.records: queue.Queue = queue.Queue(queue_size)
+        self.sample_every = round(1 / sample_rate) if sample_rate > 0 else 0
+        self.sampled = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.writing_loop, name="log-writer", daemon=True)
+        self.thread.start()
+
+    def emit(self, record: logging.LogRecord):
+        """
+        Put record to queue without blocking
+        """
+        if record.name == MESSAGES_LOGGER and self.sample_every != 1:
+            self.sampled += 1
+            if not self.sample_every or self.sampled % self.sample_every:
+                return
+        try:
+            self.records.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def writing_loop(self):
+        """
+        Format and write records, all records that are waiting in queue are written by one write call
+        """
+        while True:
+            records = [self.records.get()]
+            while records[-1] is not None and len(records) < BATCH_SIZE:
+                try:
+                    records.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            stopped = records[-1] is None
+            lines = []
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                lines.append("{} log records were dropped, log stream is too slow".format(dropped))
+            for record in records:
+                if record is not None:
+                    try:
+                        lines.append(self.format(record))
+                    except Exception:   # pylint: disable=W0703     # logging should never break server
+                        self.handleError(record)
+            if lines:
+                try:
+                    self.stream.write("\n".join(lines) + "\n")
+                    self.stream.flush()
+                except (OSError, ValueError):
+                    pass    # stream was closed
+            if stopped:
+                return
+
+    def close(self):
+        """
+        Write all queued records and stop background thread
+        """
+        if self.thread.is_alive():
+            self.records.put(None)
+            self.thread.join(timeout=5)
+        super().close()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Structured log format: JSON object per line
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+                 "level": record.levelname,
+                 "logger": record.name,
+                 "message": record.getMessage()}
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
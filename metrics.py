@@ -0,0 +1,224 @@
+"""
+Metrics of chat server: counters and latency histograms
+
+Metrics are shown by [server] stats command and exported in Prometheus text format:
+    CHAT_METRICS_PORT=9100 python server.py
+    curl http://127.0.0.1:9100/metrics
+
+CHAT_METRICS=0 disables metrics: counters and histograms are replaced with no-op objects,
+Timer does not read clock.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple, Union
+
+ENABLED = os.environ.get("CHAT_METRICS", "1") != "0"
+METRICS_PORT = int(os.environ.get("CHAT_METRICS_PORT", "0"))  # port of Prometheus endpoint, 0 - don't export
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds
+
+
+class Counter:
+    """
+    Monotonically increasing value
+    """
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        """
+        Increase counter by {amount}
+        """
+        self.value += amount
+
+
+class Histogram:
+    """
+    Distribution of durations in seconds, counts are kept per bucket of BUCKETS (+ one bucket for bigger values)
+    """
+    __slots__ = ("counts", "sum", "count", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        """
+        Add one duration
+        """
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+
+class NullMetric:
+    """
+    Counter and histogram that ignore all values, used when metrics are disabled
+    """
+    __slots__ = ()
+
+    def inc(self, amount: int = 1):
+        """
+        Do nothing
+        """
+
+    def observe(self, seconds: float):
+        """
+        Do nothing
+        """
+
+
+NULL_METRIC = NullMetric()
+Metric = Union[Counter, Histogram, NullMetric]
+Labels = Tuple[Tuple[str, str], ...]
+
+registry: Dict[Tuple[str, Labels], Metric] = {}  # (name, labels) -> metric
+descriptions: Dict[str, str] = {}  # name -> help text
+
+
+def get_metric(metric_class, name: str, description: str, labels: Dict[str, str]) -> Metric:
+    """
+    Return registered metric or register new one
+    """
+    if not ENABLED:
+        return NULL_METRIC
+    key = (name, tuple(sorted(labels.items())))
+    metric = registry.get(key)
+    if metric is None:
+        metric = registry[key] = metric_class()
+        descriptions[name] = description
+    return metric
+
+
+def counter(name: str, description: str, **labels: str) -> Counter:
+    """
+    Counter with {name} and {labels}, it is created on the first call
+    """
+    return get_metric(Counter, name, description, labels)
+
+
+def histogram(name: str, description: str, **labels: str) -> Histogram:
+    """
+    Histogram with {name} and {labels}, it is created on the first call
+    """
+    return get_metric(Histogram, name, description, labels)
+
+
+class Timer:
+    """
+    Context manager that adds duration of code block to histogram
+    """
+    __slots__ = ("histogram", "start_time")
+
+    def __init__(self, target: Histogram):
+        self.histogram = target
+        self.start_time = 0.0
+
+    def __enter__(self):
+        if ENABLED:
+            self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if ENABLED:
+            self.histogram.observe(time.perf_counter() - self.start_time)
+
+
+def timer(fun):
+    """
+    Decorator that adds durations of function calls to chat_function_seconds histogram
+    """
+    if not ENABLED:
+        return fun
+    target = histogram("chat_function_seconds", "Duration of decorated functions", function=fun.__name__)
+
+    def wrapper(*args, **kwargs):
+        with Timer(target):
+            return fun(*args, **kwargs)
+    return wrapper
+
+
+def format_labels(labels: Labels, extra: str = "") -> str:
+    """
+    Labels in Prometheus format, i.e. {game="quiz"}
+    """
+    items = ['{}="{}"'.format(key, value) for key, value in labels] + ([extra] if extra else [])
+    return "{{{}}}".format(",".join(items)) if items else ""
+
+
+def render() -> str:
+    """
+    All metrics in Prometheus text format
+    """
+    lines = []
+    described = set()
+    for (name, labels), metric in sorted(list(registry.items()), key=lambda item: item[0]):
+        if name not in described:
+            described.add(name)
+            lines.append("# HELP {} {}".format(name, descriptions[name]))
+            lines.append("# TYPE {} {}".format(name, "counter" if isinstance(metric, Counter) else "histogram"))
+        if isinstance(metric, Counter):
+            lines.append("{}{} {}".format(name, format_labels(labels), metric.value))
+            continue
+        cumulative = 0
+        for bucket, count in zip(BUCKETS + ("+Inf",), list(metric.counts)):
+            cumulative += count
+            lines.append("{}_bucket{} {}".format(name, format_labels(labels, 'le="{}"'.format(bucket)), cumulative))
+        lines.append("{}_sum{} {}".format(name, format_labels(labels), metric.sum))
+        lines.append("{}_count{} {}".format(name, format_labels(labels), metric.count))
+    return "\n".join(lines) + "\n"
+
+
+def summary() -> List[str]:
+    """
+    Short human-readable summary of metrics: counter values, count/avg/max of histograms in milliseconds
+    """
+    lines = []
+    for (name, labels), metric in sorted(list(registry.items()), key=lambda item: item[0]):
+        if isinstance(metric, Counter):
+            lines.append("{}{}: {}".format(name, format_labels(labels), metric.value))
+        elif metric.count:
+            lines.append("{}{}: count {}, avg {:.3f} ms, max {:.3f} ms".format(
+                name, format_labels(labels), metric.count, metric.sum / metric.count * 1000, metric.max * 1000))
+    return lines
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Serves GET /metrics
+    """
+
+    def do_GET(self):  # pylint: disable=C0103     # name is defined by BaseHTTPRequestHandler
+        """
+        Return metrics in Prometheus text format
+        """
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        """
+        Don't write requests to stderr
+        """
+
+
+def start_endpoint(port: int) -> ThreadingHTTPServer:
+    """
+    Start HTTP server with metrics endpoint in background thread, so scraping never blocks chat loop
+    """
+    http_server = ThreadingHTTPServer(("", port), MetricsHandler)
+    threading.Thread(target=http_server.serve_forever, name="metrics", daemon=True).start()
+    return http_server
@@ -0,0 +1,161 @@
+"""
+Chat rooms
+
+Every registered user is a member of exactly one room, public messages are sent only to members of sender's room,
+so broadcast cost depends on room size, not on count of users on server.
+Every room has its own history of public messages, messages of history are numbered from 1 (sequence numbers),
+so reconnected client can get only messages that it missed.
+"""
+import os
+import re
+import socket
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from history import History, MessageLog, MESSAGE_LOG_DIR
+
+DEFAULT_ROOM = "main"  # users join this room after registration
+ROOM_NAME_PATTERN = re.compile(r"^[\w-]{1,32}$")
+
+
+class Room:
+    """
+    Room members and history of public messages
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.members: Dict[socket.socket, None] = {}  # ordered set of member sockets
+        self.history = History()
+        self.message_log = MessageLog(os.path.join(MESSAGE_LOG_DIR, name)) if MESSAGE_LOG_DIR else None
+        self.seq = len(self.message_log) if self.message_log is not None else 0  # number of the last message
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def save(self, frame: bytes) -> int:
+        """
+        Save encoded public message to history
+
+        :return: int, sequence number of the message
+        """
+        self.history.append(frame)
+        if self.message_log is not None:
+            self.message_log.append(frame)
+        self.seq += 1
+        return self.seq
+
+    def history_size(self) -> int:
+        """
+        Count of public messages that can be sent from history
+        """
+        return len(self.message_log) if self.message_log is not None else len(self.history)
+
+    def last_messages(self, count: int) -> bytes:
+        """
+        The last {count} public messages as encoded frames.
+        In-memory history is used if it has enough messages, otherwise they are read from message log.
+        """
+        if self.message_log is not None and len(self.history) < count:
+            return self.message_log.last(count)
+        return self.history.last(count)
+
+    def messages_after(self, seq: int, limit: int) -> Tuple[int, bytes]:
+        """
+        Public messages after message with sequence number {seq} (as many of them as history has,
+        but not more than the last {limit} ones).
+        If {seq} is bigger than the number of the last message (server was restarted without persistent history),
+        all messages of history are returned.
+
+        :return: tuple (sequence number of the first returned message, encoded frames)
+        """
+        count = min(self.seq - seq if seq <= self.seq else self.seq, self.history_size(), limit)
+        return self.seq - count + 1, self.last_messages(count) if count else b""
+
+    def close(self):
+        """
+        Close message log of the room
+        """
+        if self.message_log is not None:
+            self.message_log.close()
+
+
+class Rooms:
+    """
+    Registry of rooms and their members
+    """
+
+    def __init__(self):
+        self.by_name: Dict[str, Room] = {}
+        self.by_socket: Dict[socket.socket, Room] = {}
+
+    def __iter__(self) -> Iterator[Room]:
+        return iter(list(self.by_name.values()))
+
+    def get(self, name: str) -> Room:
+        """
+        Room with {name}, it is created if it does not exist
+        """
+        room = self.by_name.get(name)
+        if room is None:
+            room = self.by_name[name] = Room(name)
+        return room
+
+    def room_of(self, sock: socket.socket) -> Room:
+        """
+        Room of registered user
+        """
+        return self.by_socket[sock]
+
+    def join(self, sock: socket.socket, name: str) -> Room:
+        """
+        Move user from the current room (if any) to room with {name}
+
+        :param sock: socket of registered user
+        :param name: str, room name
+        :return: Room
+        """
+        self.leave(sock)
+        room = self.get(name)
+        room.members[sock] = None
+        self.by_socket[sock] = room
+        return room
+
+    def leave(self, sock: socket.socket) -> Optional[Room]:
+        """
+        Remove user from its room, empty rooms are removed (except default one)
+
+        :param sock: socket
+        :return: Room that user left or None if user was not in any room
+        """
+        room = self.by_socket.pop(sock, None)
+        if room is not None:
+            del room.members[sock]
+            if not room.members and room.name != DEFAULT_ROOM:
+                room.close()
+                del self.by_name[room.name]
+        return room
+
+    def names(self) -> List[str]:
+        """
+        Names of all rooms with count of members, i.e. "main (3)"
+        """
+        return ["{} ({})".format(room.name, len(room)) for room in self.by_name.values()]
+
+    def flush_logs(self) -> bool:
+        """
+        Write buffered messages of all rooms to their logs
+
+        :return: bool, True if some logs have messages that are not synced to disk yet, see MessageLog.flush
+        """
+        unsynced = False
+        for room in self.by_name.values():
+            if room.message_log is not None:
+                unsynced = room.message_log.flush() or unsynced
+        return unsynced
+
+    def close(self):
+        """
+        Close message logs of all rooms
+        """
+        for room in self.by_name.values():
+            room.close()
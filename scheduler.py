@@ -0,0 +1,108 @@
+"""
+Scheduler of delayed calls for server event loop
+
+Calls are kept in heap ordered by deadline, server loop waits in select until the nearest deadline
+and runs due calls in the same thread as other handlers, so timeouts of games and other features
+need no threads and no locks.
+"""
+import heapq
+import itertools
+import logging
+import time
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger('chat_logger')
+
+COMPACT_THRESHOLD = 64  # rebuild heap when there are more cancelled calls than this and than active ones
+
+
+class ScheduledCall:
+    """
+    Handle of delayed call, it can be cancelled before deadline
+    """
+    __slots__ = ("deadline", "callback", "args", "cancelled", "in_heap")
+
+    def __init__(self, deadline: float, callback: Callable, args: tuple):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self.in_heap = True     # only cancelled calls that are still in heap are counted by Scheduler.cancelled
+
+
+class Scheduler:
+    """
+    Deadline-ordered heap of delayed calls
+    """
+
+    def __init__(self):
+        self.heap: List[Tuple[float, int, ScheduledCall]] = []
+        self.counter = itertools.count()  # keeps order of calls with the same deadline
+        self.cancelled = 0  # cancelled calls that are still in heap
+
+    def __len__(self) -> int:
+        """
+        Count of active calls
+        """
+        return len(self.heap) - self.cancelled
+
+    def call_later(self, delay: float, callback: Callable, *args) -> ScheduledCall:
+        """
+        Call {callback} with {args} after {delay} seconds
+
+        :return: ScheduledCall, handle for cancelling
+        """
+        call = ScheduledCall(time.monotonic() + delay, callback, args)
+        heapq.heappush(self.heap, (call.deadline, next(self.counter), call))
+        return call
+
+    def cancel(self, call: ScheduledCall):
+        """
+        Cancel call, it is removed from heap lazily
+        """
+        if call.cancelled:
+            return
+        call.cancelled = True
+        if not call.in_heap:    # call is already taken by run_due
+            return
+        self.cancelled += 1
+        if self.cancelled > COMPACT_THRESHOLD and self.cancelled > len(self.heap) // 2:
+            for _, _, removed in self.heap:
+                removed.in_heap = not removed.cancelled
+            self.heap = [entry for entry in self.heap if not entry[2].cancelled]
+            heapq.heapify(self.heap)
+            self.cancelled = 0
+
+    def timeout(self) -> Optional[float]:
+        """
+        Seconds until the nearest deadline, None if there are no calls
+        """
+        while self.heap and self.heap[0][2].cancelled:
+            heapq.heappop(self.heap)[2].in_heap = False
+            self.cancelled -= 1
+        if not self.heap:
+            return None
+        return max(self.heap[0][0] - time.monotonic(), 0)
+
+    def run_due(self):
+        """
+        Run calls with passed deadlines.
+        Calls that are scheduled by them with zero delay are run on the next iteration of server loop.
+        """
+        now = time.monotonic()
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            _, _, call = heapq.heappop(self.heap)
+            call.in_heap = False
+            if call.cancelled:
+                self.cancelled -= 1
+            else:
+                due.append(call)
+        for call in due:
+            if call.cancelled:  # cancelled by previous call after it was removed from heap
+                continue
+            call.cancelled = True   # call is done, cancel() does nothing
+            try:
+                call.callback(*call.args)
+            except Exception as ex:     # pylint: disable=W0703     # one broken call should not stop server
+                logger.error("Scheduled call failed:(\n{}".format(ex))
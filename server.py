@@ -4,11 +4,14 @@ Create server socket and start endless loop with checking client socket response
 Start:
 - for connecting to localhost:     python server.py
 - for connecting to remote host:   python server.py ip_address port
+- with several worker processes:   CHAT_WORKERS=4 python server.py (see cluster.py)
+- linked with other servers:       CHAT_PEER_PORT=9888 CHAT_PEERS=host:port python server.py (see federation.py)
 
 Features:
 - All users have unique name
-- User can get the last chat messages by sending any message or pressing Enter
-- Users can send public message just typing any text
+- User joins the main room after registration and can move to another room using [server] join <room>
+- User gets the last messages of the room after joining it and can request them using [server] history N
+- Users can send public message to their room just typing any text
 - Users can send private message, i.e [recipient] message
 - Users can interact with server, i.e. [server] command
 - List of server commands:
@@ -17,24 +20,41 @@ Features:
     [server] participants-count     - return count of chat participants
     [server] rock-paper-scissors    - play rock-paper-scissors game with server
     [server] 21                     - play 21 game with server
-    [server] quiz                   - quiz game for all participants
+    [server] quiz [category]        - quiz game for all participants of the room
+    [server] history [N]            - return the last N public messages
+    [server] search <text>          - return the last public messages with text (needs persistent history)
+    [server] rooms                  - return list of rooms with count of their members
+    [server] join <room>            - leave the current room and join another one (it is created if needed)
+    [server] stats                  - return server metrics (see metrics.py)
 - Asyncio: receiving and sending messages work with asyncio for client app
 - Slack features:
-    - All messages from selected slack channel send to this chat room
-    - All public messages from this chat room send to slack channel
+    - All messages from selected slack channel send to the main chat room
+    - All public messages from the main chat room send to slack channel
     - Simple AI to answer on private messages to slack bot
 """
-import select
+import selectors
 import socket
-from typing import Optional, Tuple
+import sys
+from typing import Callable, Dict, List, Optional, Tuple
 import logging.config
+import cluster
 import common
-from games.game_21 import one_player_game_21
-from games.game_quiz import all_players_game_quiz
-from games.game_rock_paper_scissors import one_player_game_rock_paper_scissors
+import federation
+import games
+import history
+import metrics
 
 logger = logging.getLogger('chat_logger')
 
+SEARCH_LIMIT = 10  # max count of messages found by [server] search
+MAX_LIST_SIZE = 16 * 1024  # bytes of names in one list reply (participants, rooms), the rest are only counted
+
+ACCEPTED = metrics.counter("chat_accepted_connections_total", "Accepted client connections")
+DISCONNECTED = metrics.counter("chat_disconnected_clients_total", "Disconnected client connections")
+ACCEPT_SECONDS = metrics.histogram("chat_accept_seconds", "Duration of registering and greeting accepted connection")
+MESSAGES = metrics.counter("chat_messages_total", "Messages received from registered users")
+PROCESS_MESSAGE_SECONDS = metrics.histogram("chat_process_message_seconds", "Duration of processing one message")
+
 
 def split_message(msg: str) -> Tuple[Optional[str], str]:
     """
@@ -52,16 +72,88 @@ def split_message(msg: str) -> Tuple[Optional[str], str]:
     return None, msg
 
 
-def process_message_to_server(sock: socket.socket, cmd: str):
+def remote_names() -> List[str]:
     """
-    Process commands like '[server] <command>'
+    Usernames of users connected to other worker processes and linked servers
+    """
+    names = common.bus.names() if common.bus is not None else []
+    if common.federation is not None:
+        names += common.federation.names()
+    return names
+
+
+def send_history(sock: socket.socket, count: str):
+    """
+    Send the last public messages of user's room as one buffer.
+    Count is limited by MAX_HISTORY_REPLAY and size of reply by MAX_REPLAY_SIZE.
 
     :param sock: socket
-    :param cmd: str, command that can be processed, see help command for details
+    :param count: str, count of messages, HISTORY_REPLAY_COUNT if it is not a number
+    :return: None
+    """
+    room = common.rooms.room_of(sock)
+    count = min(int(count) if count.isdigit() else common.HISTORY_REPLAY_COUNT, common.MAX_HISTORY_REPLAY,
+                room.history_size())
+    if not count:
+        common.private_message(common.server_socket, sock, "History is empty")
+        return
+    skipped, frames = common.limit_replay(room.last_messages(count))
+    common.private_message(common.server_socket, sock, "The last {} message(s):".format(count - skipped))
+    common.send_data(sock, frames)
+
+
+def search_history(sock: socket.socket, text: str):
+    """
+    Send the last public messages of user's room that contain {text}
+
+    :param sock: socket
+    :param text: str
+    :return: None
+    """
+    message_log = common.rooms.room_of(sock).message_log
+    if message_log is None:
+        common.private_message(common.server_socket, sock, "Search is not available: persistent history is disabled")
+        return
+    if not text:
+        common.private_message(common.server_socket, sock, "What should be found? [server] search <text>")
+        return
+    found = message_log.search(text, SEARCH_LIMIT)
+    skipped, frames = common.limit_replay(b"".join(found))
+    common.private_message(common.server_socket, sock, "Found {} message(s):".format(len(found) - skipped))
+    if frames:
+        common.send_data(sock, frames)
+
+
+def join_room(sock: socket.socket, name: str):
+    """
+    Move user to room with {name}, notify members of both rooms and send the last messages of the new room
+
+    :param sock: socket
+    :param name: str, room name
     :return: None
     """
-    if cmd == "help":
-        about_chat = """To send a public message: just send any text.
+    if not common.ROOM_NAME_PATTERN.match(name):
+        common.private_message(common.server_socket, sock, "Room name should contain only letters, digits, '_' "
+                                                           "or '-' (up to 32 characters): [server] join <room>")
+        return
+    username = common.participants.name(sock)
+    room = common.rooms.room_of(sock)
+    if room.name == name:
+        common.private_message(common.server_socket, sock, "You are already in room '{}'".format(name))
+        return
+    common.rooms.leave(sock)
+    common.send_to_room(room, "User '{}' left the room".format(username))
+    room = common.rooms.join(sock, name)
+    common.send_to_room(room, "User '{}' joined the room".format(username), sock)
+    common.private_message(common.server_socket, sock, "You joined room '{}'".format(name))
+    common.send_last_messages(sock, room, common.HISTORY_REPLAY_COUNT)
+
+
+def send_help(sock: socket.socket, _: str):
+    """
+    Send info about chat and list of server commands
+    """
+    about_chat = """To send a public message: just send any text.
         To send private message: [<username>] <your message>
         To send message to server: [server] command
         Server supports the following commands:
@@ -70,25 +162,119 @@ def process_message_to_server(sock: socket.socket, cmd: str):
         [server] participants-count - return count of chat participants
         [server] rock-paper-scissors - play rock-paper-scissors game with server
         [server] 21 - play 21 game with server
-        [server] quiz - quiz game for all participants"""
-        common.private_message(common.server_socket, sock, about_chat)
-    elif cmd == "participants":
-        participants = list(common.sockets_list.values())
-        participants.remove(common.sockets_list[common.server_socket])
-        common.private_message(common.server_socket, sock, "List of participants: {}".format(", ".join(participants)))
-    elif cmd == "participants-count":
-        common.private_message(common.server_socket, sock, "Participants count: {}"
-                               .format(len(common.sockets_list.values()) - 1))
-    elif cmd == "rock-paper-scissors":
-        one_player_game_rock_paper_scissors(sock, common.INIT_GAME_MSG)
-    elif cmd == "21":
-        one_player_game_21(sock, common.INIT_GAME_MSG)
-    elif cmd == "quiz":
-        all_players_game_quiz(None, common.INIT_GAME_MSG)
+        [server] quiz [category] - quiz game for all participants of the room
+        [server] history [N] - return the last N public messages
+        [server] search <text> - return the last public messages with text
+        [server] rooms - return list of rooms with count of their members
+        [server] join <room> - leave the current room and join another one
+        [server] stats - return server metrics"""
+    common.private_message(common.server_socket, sock, about_chat)
+
+
+def send_list(sock: socket.socket, title: str, items: List[str]):
+    """
+    Send "{title}: <comma-separated items>" as one message.
+    Items that don't fit into MAX_LIST_SIZE are not sent, their count is added instead,
+    so reply never exceeds frame limit of client.
+
+    :param sock: socket
+    :param title: str, i.e. "List of rooms"
+    :param items: list of str
+    :return: None
+    """
+    size = shown = 0
+    for item in items:
+        size += len(item.encode()) + 2
+        if size > MAX_LIST_SIZE:
+            break
+        shown += 1
+    text = ", ".join(items[:shown])
+    if shown < len(items):
+        text += " and {} more".format(len(items) - shown)
+    common.private_message(common.server_socket, sock, "{}: {}".format(title, text))
+
+
+def send_participants(sock: socket.socket, _: str):
+    """
+    Send names of participants of all worker processes and linked servers
+    """
+    participants = common.participants.names() + remote_names()
+    participants.remove(common.participants.name(common.server_socket))
+    send_list(sock, "List of participants", participants)
+
+
+def send_participants_count(sock: socket.socket, _: str):
+    """
+    Send count of participants of all worker processes and linked servers
+    """
+    common.private_message(common.server_socket, sock, "Participants count: {}"
+                           .format(len(common.participants) + len(remote_names()) - 1))
+
+
+def send_rooms(sock: socket.socket, _: str):
+    """
+    Send list of rooms with count of their members
+    """
+    send_list(sock, "List of rooms", common.rooms.names())
+
+
+def send_stats(sock: socket.socket, _: str):
+    """
+    Send summary of server metrics
+    """
+    stats = metrics.summary() if metrics.ENABLED else ["Metrics are disabled"]
+    common.private_message(common.server_socket, sock, "Server stats:\n{}".format("\n".join(stats)))
+
+
+COMMANDS: Dict[str, Callable[[socket.socket, str], None]] = {
+    "help": send_help,
+    "participants": send_participants,
+    "participants-count": send_participants_count,
+    "history": send_history,
+    "search": search_history,
+    "rooms": send_rooms,
+    "join": join_room,
+    "stats": send_stats}  # command -> function (sock, arguments), games are started via games.GAMES
+
+
+def process_message_to_server(sock: socket.socket, cmd: str):
+    """
+    Process commands like '[server] <command> [arguments]'
+
+    :param sock: socket
+    :param cmd: str, command that can be processed, see help command for details
+    :return: None
+    """
+    name, _, arguments = cmd.partition(" ")
+    command = COMMANDS.get(name)
+    if command is not None:
+        command(sock, arguments.strip())
+    elif name in games.GAMES:
+        games.get_game(name)(sock, arguments.strip())
     else:
         common.private_message(common.server_socket, sock, "Unknown command")
 
 
+def send_remote_private_message(recipient: str, msg: str) -> bool:
+    """
+    Send private message to user of another worker process or linked server
+
+    :return: bool, False if there is no such user
+    """
+    if common.bus is not None and common.bus.send_private(recipient, msg):
+        return True
+    return common.federation is not None and common.federation.send_private(recipient, msg)
+
+
+def play_game(handler: Callable, sock: socket.socket, msg: str):
+    """
+    Pass message to game handler, duration is added to chat_game_handler_seconds histogram of this game
+    """
+    with metrics.Timer(metrics.histogram("chat_game_handler_seconds", "Duration of game handler calls",
+                                         game=handler.__name__)):
+        handler(sock, msg)
+
+
 def process_message(sock: socket.socket, msg: str):
     """
     Common function for processing message from socket
@@ -97,23 +283,27 @@ def process_message(sock: socket.socket, msg: str):
     :param msg: str, message from socket
     :return: None
     """
+    MESSAGES.inc()
     try:
-        if common.all_player_game:
-            common.all_player_game["game"](sock, msg)
-        elif sock in common.one_player_game_list:
-            common.one_player_game_list[sock]["game"](sock, msg)
+        if sock in common.one_player_game_list:
+            play_game(common.one_player_game_list[sock].game, sock, msg)
         else:
             recipient, cmd = split_message(msg)
-            if recipient is None:
-                common.send_to_all("[{}] {}".format(common.sockets_list[sock], cmd), sock)
+            room = common.rooms.room_of(sock)
+            if recipient is None and room.name in common.all_player_games:
+                # public messages are answers while game is running in the room, other rooms are not affected
+                play_game(common.all_player_games[room.name].game, sock, cmd)
+            elif recipient is None:
+                common.send_to_room(room, "[{}] {}".format(common.participants.name(sock), cmd), sock, to_history=True)
             else:
-                recipient_socket = common.get_socket_by_name(recipient)
-                msg = "[{}] -> [{}] {}".format(common.sockets_list[sock], recipient, cmd)
-                logger.info(msg)
+                recipient_socket = common.participants.get_socket(recipient)
+                msg = "[{}] -> [{}] {}".format(common.participants.name(sock), recipient, cmd)
+                common.messages_logger.info(msg)
 
                 if recipient_socket is None:
-                    common.send_to_one(sock, "Unknown recipient. Please try again.")
-                elif recipient == common.sockets_list[common.server_socket]:
+                    if not send_remote_private_message(recipient, msg):
+                        common.send_to_one(sock, "Unknown recipient. Please try again.")
+                elif recipient_socket is common.server_socket:
                     process_message_to_server(sock, cmd)
                 else:
                     # Private message from client to client
@@ -122,41 +312,228 @@ def process_message(sock: socket.socket, msg: str):
         logger.error("Something goes wrong:(\n{}".format(ex))
 
 
+def accept_connections():
+    """
+    Accept all pending connections from the listening socket and register them in selector
+    """
+    while True:
+        try:
+            client_socket, _ = common.server_socket.accept()
+        except BlockingIOError:
+            return
+        except OSError as ex:
+            logger.error("Connection was not accepted:(\n{}".format(ex))
+            return
+        with metrics.Timer(ACCEPT_SECONDS):
+            common.add_client_socket(client_socket)
+            common.send_to_one(client_socket, "Hi! You are trying to connect to chat room.\nWhat is your name?")
+        ACCEPTED.inc()
+
+
+def disconnect(sock: socket.socket):
+    """
+    Unregister and close client socket, notify other participants of the room
+
+    :param sock: socket
+    :return: None
+    """
+    DISCONNECTED.inc()
+    room = common.rooms.leave(sock)
+    username = common.remove_client_socket(sock)
+    if room is None:
+        logger.info("Unknown user was disconnected")
+    else:
+        common.send_to_room(room, "User '{}' was disconnected".format(username))
+        if common.bus is not None:
+            common.bus.release(username)
+        if common.federation is not None:
+            common.federation.user_left(username)
+
+
+def disconnect_broken_sockets():
+    """
+    Disconnect sockets that were marked as broken while sending messages (send errors, slow consumers)
+    """
+    while common.broken_sockets:
+        disconnect(common.broken_sockets.pop())
+
+
+def read_messages(sock: socket.socket):
+    """
+    Read messages from client socket and process them
+
+    :param sock: socket, readable client socket
+    :return: None
+    """
+    try:
+        for message in common.decoders[sock].read(sock):
+            if not message or sock in common.broken_sockets:
+                continue
+            if not common.participants.name(sock):
+                common.user_registration(sock, message)
+            else:
+                with metrics.Timer(PROCESS_MESSAGE_SECONDS):
+                    process_message(sock, message)
+    except BlockingIOError:
+        pass
+    except ConnectionError:
+        disconnect(sock)
+
+
+def start_bot_bridges() -> socket.socket:
+    """
+    Start bot bridges, they wake up server loop using socket pair when new messages are received from bots
+
+    :return: socket, registered in selector, it becomes readable when there are new messages from bots
+    """
+    wakeup_reader, wakeup_writer = socket.socketpair()
+    wakeup_reader.setblocking(False)
+    wakeup_writer.setblocking(False)
+    common.selector.register(wakeup_reader, selectors.EVENT_READ)
+
+    def wakeup():
+        try:
+            wakeup_writer.send(b"\0")
+        except BlockingIOError:
+            pass    # server loop is already woken up
+
+    for bridge in common.bot_bridges:
+        bridge.start(wakeup)
+    return wakeup_reader
+
+
+def process_bot_messages(wakeup_reader: socket.socket):
+    """
+    Send messages received from bots to their chat rooms
+    """
+    try:
+        while wakeup_reader.recv(common.BUFFER_SIZE):
+            pass
+    except BlockingIOError:
+        pass
+    for bridge in common.bot_bridges:
+        for msg in bridge.received():
+            if len(msg.encode()) > common.MAX_CLIENT_MESSAGE_SIZE:
+                logger.warning("Message from bot {} is too long, it is dropped".format(bridge.name()))
+                continue
+            common.send_to_room(common.rooms.get(bridge.room), msg, ignore_bot=bridge.name(), to_history=True)
+
+
+def process_bus_event(event: dict):
+    """
+    Process event from other worker process or linked server
+    """
+    if event["type"] == "room":
+        # rooms without local members are not created, they would never be removed (see Rooms.leave)
+        room = common.rooms.by_name.get(event["room"])
+        if room is not None:
+            common.send_to_room_members(room, event["msg"], to_history=event["history"])
+    elif event["type"] == "private":
+        recipient_socket = common.participants.get_socket(event["to"])
+        if recipient_socket is not None:
+            common.send_to_one(recipient_socket, event["msg"])
+    elif event["type"] == "claimed":
+        sock, name = common.bus.answer(event)
+        if sock not in common.participants:
+            if event["ok"]:
+                common.bus.release(name)    # user was disconnected while waiting for answer
+        elif event["ok"]:
+            common.register_user(sock, name)
+        else:
+            common.name_is_not_available(sock, name)
+
+
+def flush_logs():
+    """
+    Write buffered public messages to logs. While some of them are not synced to disk,
+    flush is repeated after FSYNC_INTERVAL, so the last batch is synced even if rooms get no more messages.
+    """
+    if common.rooms.flush_logs() and common.log_sync_call is None:
+        common.log_sync_call = common.scheduler.call_later(history.FSYNC_INTERVAL, sync_logs)
+
+
+def sync_logs():
+    """
+    Timed flush of message logs
+    """
+    common.log_sync_call = None
+    flush_logs()
+
+
+def process_bus(mask: int):
+    """
+    Receive events from message bus and send pending ones, worker is stopped if master process is stopped
+    """
+    try:
+        if mask & selectors.EVENT_READ:
+            for event in common.bus.receive():
+                process_bus_event(event)
+        if mask & selectors.EVENT_WRITE:
+            common.bus.link.flush()
+    except ConnectionError:
+        logger.error("Message bus was stopped")
+        sys.exit()
+
+
+def process_event(sock, mask: int, wakeup_reader):
+    """
+    Process one event of selector
+
+    :param sock: socket with event
+    :param mask: selectors.EVENT_READ and/or selectors.EVENT_WRITE
+    :param wakeup_reader: socket that is written when bots have new messages
+    """
+    if sock is common.server_socket:
+        accept_connections()
+    elif sock is wakeup_reader:
+        process_bot_messages(wakeup_reader)
+    elif common.bus is not None and sock is common.bus.link.sock:
+        process_bus(mask)
+    elif common.federation is not None and sock in common.federation:
+        for event in common.federation.process(sock, mask):
+            process_bus_event(event)
+    elif sock in common.broken_sockets or sock not in common.participants:
+        return  # socket was closed or will be closed while processing previous events
+    else:
+        if mask & selectors.EVENT_WRITE:
+            common.flush(sock)
+        if mask & selectors.EVENT_READ:
+            read_messages(sock)
+
+
 def start_server():
     """
     Create server socket and start endless loop with checking client socket responses
     """
-    common.create_server_socket()
+    if cluster.BUS_PATH:
+        common.bus = cluster.Bus(cluster.BUS_PATH)
+        if cluster.WORKER_ID:
+            common.bot_bridges.clear()  # bots are served by the first worker, other workers get their messages via bus
+    common.create_server_socket(reuse_port=common.bus is not None)
+    if federation.PEER_PORT or federation.PEERS:
+        common.federation = federation.Federation(federation.PEER_PORT, federation.PEERS)
+    if metrics.ENABLED and metrics.METRICS_PORT:
+        metrics.start_endpoint(metrics.METRICS_PORT)
+    wakeup_reader = start_bot_bridges()
 
     while True:
-        read_sockets, _, _ = select.select(common.sockets_list.keys(), [], [], 1)
-
-        for read_socket in read_sockets:
-            if read_socket == common.server_socket:
-                client_socket, _ = read_socket.accept()
-                common.sockets_list[client_socket] = ""
-                common.send_to_one(client_socket, "Hi! You are trying to connect to chat room.\nWhat is your name?")
-            else:
-                try:
-                    message = read_socket.recv(common.BUFFER_SIZE).decode()
-                    if not message:
-                        raise ConnectionError
-                    if not common.sockets_list[read_socket]:
-                        common.user_registration(read_socket, message)
-                    else:
-                        process_message(read_socket, message)
-                except ConnectionError:
-                    username = common.sockets_list.pop(read_socket)
-                    if username == "":
-                        logger.info("Unknown user was disconnected")
-                    else:
-                        common.send_to_all("User '{}' was disconnected".format(username))
-
-        for bot in common.bots:
-            messages = bot.get_messages()
-            for msg in messages:
-                common.send_to_all(msg, ignore_bot=bot.name())
+        for key, mask in common.selector.select(common.scheduler.timeout()):
+            process_event(key.fileobj, mask, wakeup_reader)
+        common.scheduler.run_due()
+        disconnect_broken_sockets()
+        flush_logs()
+        if common.bus is not None:
+            process_bus(selectors.EVENT_WRITE)  # events of this iteration are sent together
+        if common.federation is not None:
+            common.federation.flush()
 
 
 if __name__ == "__main__":
-    start_server()
+    if cluster.WORKERS > 1 and (federation.PEER_PORT or federation.PEERS):
+        # every worker would listen on the same peer port and peers would see workers as separate nodes
+        logger.error("Federation (CHAT_PEER_PORT, CHAT_PEERS) can not be used with CHAT_WORKERS > 1")
+        sys.exit(1)
+    if cluster.WORKERS > 1:
+        cluster.run_workers(cluster.WORKERS)
+    else:
+        start_server()
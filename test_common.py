@@ -0,0 +1,424 @@
+"""
+Unit tests for low-level functionality: framing, participants registry, history, message bus, federation, scheduler,
+games registry, metrics, logging, state of slack bot
+"""
+# pylint: disable=C0116     # docstrings
+import io
+import json
+import logging
+import select
+import sys
+import threading
+import time
+import pytest
+from bots import slack_state
+import cluster
+import common
+import federation
+import games
+from games import game_quiz, questions
+import history
+import log_handlers
+import metrics
+import scheduler
+import server
+
+
+def test_frames_in_one_chunk():
+    decoder = common.FrameDecoder()
+    data = common.encode_frame("first") + common.encode_frame("second") + common.encode_frame("")
+    assert decoder.feed(data) == ["first", "second", ""]
+    assert not decoder.buffer
+
+
+def test_frame_split_between_chunks():
+    decoder = common.FrameDecoder()
+    data = common.encode_frame("Привет, мир!") + common.encode_frame("next")
+    messages = []
+    for i in range(len(data)):
+        messages += decoder.feed(data[i:i + 1])     # multibyte characters are split too
+    assert messages == ["Привет, мир!", "next"]
+
+
+def test_frame_over_limit():
+    decoder = common.FrameDecoder()
+    with pytest.raises(common.ProtocolError):
+        decoder.feed(common.FRAME_HEADER.pack(common.MAX_MESSAGE_SIZE + 1))
+
+
+def test_long_replies(monkeypatch):
+    sent = []
+    monkeypatch.setattr(common, "private_message", lambda sender, sock, msg: sent.append(msg))
+    server.send_list(None, "List of rooms", ["main (1)", "dev (2)"])
+    names = ["user-{:05}".format(i) for i in range(10000)]
+    server.send_list(None, "List of participants", names)
+    assert sent[0] == "List of rooms: main (1), dev (2)"
+    shown = sent[1].split(": ", 1)[1].split(", ")
+    assert len(sent[1]) <= server.MAX_LIST_SIZE + 100 and shown[-1].endswith(" and {} more".format(10000 - len(shown)))
+
+    assert not common.is_over_limit(common.encode_frame("x" * common.MAX_MESSAGE_SIZE))
+    assert common.is_over_limit(common.encode_frame("x" * (common.MAX_MESSAGE_SIZE + 1)))
+
+
+def test_participants_registry():
+    participants = common.Participants()
+    sock1, sock2 = object(), object()
+    participants.connect(sock1)
+    participants.connect(sock2)
+    assert participants.name(sock1) == "" and len(participants) == 0
+
+    participants.register(sock1, "Test User")
+    assert participants.get_socket("Test User") is sock1
+    assert participants.get_socket("test user") is sock1
+    assert not participants.is_available("TEST USER")
+    assert participants.names() == ["Test User"]
+
+    assert participants.remove(sock1) == "Test User"
+    assert participants.remove(sock2) == ""
+    assert participants.get_socket("Test User") is None
+    assert participants.is_available("test user")
+
+
+def test_history_ring_buffer():
+    ring = history.History(capacity=40)
+    frames = [common.encode_frame("message {}".format(i)) for i in range(10)]   # 13 bytes each
+    for frame in frames[:3]:
+        ring.append(frame)
+    assert ring.last(2) == frames[1] + frames[2]
+    assert ring.last(100) == b"".join(frames[:3])
+    assert len(ring.buffer) == 39   # buffer is not preallocated
+
+    for frame in frames[3:]:
+        ring.append(frame)   # buffer is wrapped around, only the last 3 frames fit
+    assert len(ring) == 3
+    assert ring.last(3) == b"".join(frames[7:])
+    assert common.FrameDecoder().feed(ring.last(2)) == ["message 8", "message 9"]
+
+
+def test_history_replay_limit(monkeypatch):
+    monkeypatch.setattr(common, "MAX_REPLAY_SIZE", 30)
+    frames = [common.encode_frame("message {}".format(i)) for i in range(10)]   # 13 bytes each
+    assert common.limit_replay(b"".join(frames[:2])) == (0, frames[0] + frames[1])
+    assert common.limit_replay(b"".join(frames)) == (8, frames[8] + frames[9])    # the newest frames are sent
+    assert common.limit_replay(b"") == (0, b"")
+
+
+def test_message_log(tmp_path, monkeypatch):
+    monkeypatch.setattr(history, "SEGMENT_SIZE", 100)
+    frames = [common.encode_frame("message {}".format(i)) for i in range(30)]
+    message_log = history.MessageLog(str(tmp_path))
+    for frame in frames:
+        message_log.append(frame)
+    assert len(message_log.segments) > 1
+    message_log.close()
+
+    message_log = history.MessageLog(str(tmp_path))     # only indexes are read after restart
+    assert len(message_log) == 30
+    assert message_log.frames(5, 12) == b"".join(frames[5:12])
+    assert message_log.last(2) == frames[28] + frames[29]
+    assert message_log.search("message 1", 3) == frames[17:20]
+    message_log.close()
+
+
+def test_message_log_sync(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(history.os, "fsync", synced.append)    # called by background thread
+    monkeypatch.setattr(history, "FSYNC_EVERY", 3)
+    message_log = history.MessageLog(str(tmp_path))
+    message_log.append(common.encode_frame("first"))
+    assert message_log.flush()  # message is written to OS, fsync should be repeated later
+    message_log.synced_at -= history.FSYNC_INTERVAL
+    assert not message_log.flush()  # interval is over, message is synced
+    for _ in range(3):
+        message_log.append(common.encode_frame("message"))
+    assert not message_log.flush()  # batch is full
+    history.syncer.wait()
+    assert len(synced) == 4     # log and index files twice
+    message_log.close()
+
+
+def test_rooms_registry():
+    rooms = common.Rooms()
+    sock1, sock2 = object(), object()
+    assert rooms.join(sock1, common.DEFAULT_ROOM) is rooms.join(sock2, common.DEFAULT_ROOM)
+    dev = rooms.join(sock1, "dev")
+    assert rooms.room_of(sock1) is dev and list(dev.members) == [sock1]
+    assert rooms.names() == ["main (1)", "dev (1)"]
+
+    assert rooms.leave(sock1) is dev    # empty room is removed
+    assert rooms.leave(sock2).name == common.DEFAULT_ROOM
+    assert rooms.names() == ["main (0)"]
+    assert rooms.leave(sock1) is None
+
+
+def test_room_sequence_numbers():
+    room = common.Room("test")
+    frames = [common.encode_frame("message {}".format(i)) for i in range(1, 6)]
+    assert [room.save(frame) for frame in frames] == [1, 2, 3, 4, 5]
+    assert room.messages_after(3, 10) == (4, frames[3] + frames[4])
+    assert room.messages_after(5, 10) == (6, b"")
+    assert room.messages_after(10, 10) == (1, b"".join(frames))   # numbering was restarted, all history is sent
+    assert room.messages_after(0, 2) == (4, frames[3] + frames[4])  # only the newest messages over limit
+    assert common.FrameDecoder().feed(common.add_sequence_numbers(room, 4, frames[3] + frames[4])) == [
+        "#test:4 message 4", "#test:5 message 5"]
+
+
+def test_registration_parsing():
+    assert common.parse_registration(" Test User ") == ("Test User", False, None)
+    assert common.parse_registration("/seq Test User") == ("Test User", True, None)
+    assert common.parse_registration("/resume dev 42 Test User") == ("Test User", True, ("dev", 42))
+    for malformed in ("/seq", "/seq  ", "/resume nosuch x Carl", "/resume dev 1", "   "):
+        assert common.parse_registration(malformed)[0] == ""
+
+
+def test_bus_username_claims(tmp_path):
+    hub = cluster.BusHub(str(tmp_path / "bus.sock"))
+    worker1, worker2 = cluster.Bus(hub.server_socket.getsockname()), cluster.Bus(hub.server_socket.getsockname())
+
+    def exchange(bus):
+        bus.link.flush()
+        for _ in range(3):
+            hub.poll(0.1)
+        readable, _, _ = select.select([bus.link.sock], [], [], 0.5)
+        return bus.receive() if readable else []
+
+    worker1.claim(None, "Test User")
+    assert exchange(worker1) == [{"type": "claimed", "id": 1, "ok": True}]
+    worker2.claim(None, "TEST USER")
+    assert exchange(worker2) == [{"type": "claimed", "id": 1, "ok": False}]
+    assert worker2.names() == ["Test User"] and not worker2.is_available("test user")
+
+    assert worker2.send_private("test user", "secret")
+    worker2.publish(common.DEFAULT_ROOM, "hello", to_history=True)
+    assert not exchange(worker2) and exchange(worker1) == [
+        {"type": "private", "to": "Test User", "msg": "secret"},
+        {"type": "room", "room": common.DEFAULT_ROOM, "msg": "hello", "history": True}]
+
+    worker1.release("Test User")
+    assert not exchange(worker1) and not exchange(worker2)
+    assert worker2.is_available("test user")
+    for link in list(hub.links.values()) + [worker1.link, worker2.link]:
+        link.close()
+
+
+def test_bus_event_for_room_without_local_members():
+    server.process_bus_event({"type": "room", "room": "remote-only", "msg": "hello", "history": True})
+    assert "remote-only" not in common.rooms.by_name
+
+
+def test_federation_deduplication(monkeypatch):
+    monkeypatch.setattr(federation, "RECONNECT_INTERVAL", 0)
+    node1 = federation.Federation(9898, [("127.0.0.1", 9899)])
+    node2 = federation.Federation(9899, [("127.0.0.1", 9898)])     # two links between nodes
+
+    def exchange():
+        events = {node1: [], node2: []}
+        for _ in range(10):
+            for key, mask in common.selector.select(0.05):
+                for node in events:
+                    if key.fileobj in node:
+                        events[node] += node.process(key.fileobj, mask)
+            common.scheduler.run_due()
+            for node in events:
+                node.flush()
+        return events[node1], events[node2]
+
+    exchange()
+    assert len(node1.links) == 2 and len(node2.links) == 2
+    node1.user_joined("Test User")
+    node1.publish(common.DEFAULT_ROOM, "hello", to_history=True)
+    assert exchange() == ([], [{"type": "room", "room": common.DEFAULT_ROOM, "msg": "hello", "history": True,
+                                "node": node1.node_id, "seq": 4}])
+    assert node2.names() == ["Test User"] and not node2.is_available("TEST USER")
+
+    for link in list(node1.links.values()):
+        node1.remove_link(link)
+    exchange()
+    assert node2.is_available("test user")
+    for node in (node1, node2):
+        for link in list(node.links.values()):
+            node.remove_link(link)
+        if node.reconnect_call is not None:
+            common.scheduler.cancel(node.reconnect_call)
+        common.selector.unregister(node.listener)
+        node.listener.close()
+
+
+def test_scheduler(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(scheduler.time, "monotonic", lambda: now[0])
+    calls = []
+    tasks = scheduler.Scheduler()
+    assert tasks.timeout() is None
+    tasks.call_later(2, calls.append, "second")
+    tasks.call_later(1, calls.append, "first")
+    cancelled = tasks.call_later(0.5, calls.append, "cancelled")
+    tasks.cancel(cancelled)
+    assert len(tasks) == 2 and tasks.timeout() == 1
+
+    now[0] += 1.5
+    tasks.run_due()
+    assert calls == ["first"] and tasks.timeout() == 0.5
+    tasks.call_later(0, lambda: tasks.call_later(0, calls.append, "next iteration"))
+    now[0] += 0.5
+    tasks.run_due()
+    assert calls == ["first", "second"]     # call scheduled during run_due waits for the next iteration
+    tasks.run_due()
+    assert calls == ["first", "second", "next iteration"] and tasks.timeout() is None
+
+
+def test_scheduler_cancel_during_run_due(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(scheduler.time, "monotonic", lambda: now[0])
+    calls = []
+    tasks = scheduler.Scheduler()
+    later = [tasks.call_later(10, calls.append, i) for i in range(100)]
+
+    def cancel_all():
+        tasks.cancel(due)
+        for call in later:     # triggers compaction
+            tasks.cancel(call)
+
+    tasks.call_later(0, cancel_all)
+    due = tasks.call_later(0, calls.append, "cancelled")
+    tasks.run_due()
+    assert len(tasks) == 0 and tasks.cancelled == len(tasks.heap)
+    now[0] += 10
+    tasks.run_due()
+    assert not calls and tasks.cancelled == 0 and tasks.timeout() is None
+
+
+def test_game_registry():
+    start_game = games.get_game("21")
+    assert start_game is games.get_game("21") and start_game.__module__ == "games.game_21"
+    game_21 = sys.modules["games.game_21"]
+    session = game_21.Game21Session()
+    assert session.game is game_21.one_player_game_21 and not hasattr(session, "__dict__")     # compact state
+    with pytest.raises(KeyError):
+        games.get_game("unknown")
+
+
+def test_question_bank(tmp_path):
+    path = tmp_path / "questions.jsonl"
+    entries = [{"question": "Question {}".format(i), "answer": "Answer  {}".format(i),
+                "category": "Odd" if i % 2 else "even"} for i in range(10)]
+    path.write_text("\n".join(json.dumps(entry) for entry in entries) + "\n\n")
+    bank = questions.QuestionBank(str(path))
+    assert len(bank) == 10 and bank.categories == {"even": (0, 5), "odd": (5, 10)}
+    question = bank.question(6)     # the second question of "odd" category
+    assert question.text == "Question 3" and question.comparison == "equal"
+    assert question.normalized_answers == ("answer 3",)
+    bank.close()
+
+    assert (tmp_path / "questions.jsonl.idx").exists()
+    bank = questions.QuestionBank(str(path))    # index file is reused
+    assert bank.category_range("ODD") == (5, 10) and bank.category_range("") == (0, 10)
+    assert bank.category_range("unknown") is None
+    assert bank.question(0).text == "Question 0"
+    bank.close()
+
+    deck = questions.Deck(5, 10)
+    drawn = [deck.draw() for _ in range(10)]
+    assert sorted(drawn[:5]) == sorted(drawn[5:]) == [5, 6, 7, 8, 9]    # no repeats until all are drawn
+
+
+def test_quiz_answer_matching():
+    question = questions.Question("Who created Python?", "Guido van Rossum", "equal", "computers", ["Guido"])
+    session = game_quiz.QuizSession(question, None)
+    assert game_quiz.is_right_answer(session, "  guido VAN rossum ") and game_quiz.is_right_answer(session, "GUIDO")
+    assert game_quiz.is_right_answer(session, "Gvido van Rosum")    # 2 typos are allowed for 16 characters
+    assert not game_quiz.is_right_answer(session, "Gvido van Rsum!") and not game_quiz.is_right_answer(session, "Gvdo")
+    assert game_quiz.is_similar("kitten", "sitting", 3) and not game_quiz.is_similar("kitten", "sitting", 2)
+
+    question.comparison = "contains"
+    assert game_quiz.is_right_answer(session, "It is Guido!") and not game_quiz.is_right_answer(session, "Gvido")
+
+
+def test_quiz_finish_in_removed_room():
+    question = questions.Question("Who created Python?", "Guido van Rossum", "equal", "computers")
+    common.all_player_games["gone"] = game_quiz.QuizSession(question, common.scheduler.call_later(60, print))
+    game_quiz.finish_game("gone")   # everybody left the room during the round
+    assert "gone" not in common.all_player_games and "gone" not in common.rooms.by_name
+
+
+def test_quiz_round_is_not_stopped_by_answer():
+    question = questions.Question("Who created Python?", "Guido van Rossum", "equal", "computers")
+    sock = object()
+    common.participants.connect(sock)
+    common.participants.register(sock, "Player")
+    common.rooms.join(sock, "quiz")
+    session = common.all_player_games["quiz"] = game_quiz.QuizSession(question, common.scheduler.call_later(60, print))
+    game_quiz.all_players_game_quiz(sock, "stop_game")
+    assert common.all_player_games["quiz"] is session and session.answers == ["[Player] stop_game"]
+    game_quiz.finish_game("quiz")
+    common.rooms.leave(sock)
+    common.participants.remove(sock)
+
+
+def test_metrics():
+    counter = metrics.counter("test_events_total", "Test events", kind="test")
+    latency = metrics.histogram("test_latency_seconds", "Test latency")
+    counter.inc(3)
+    latency.observe(0.0003)
+    latency.observe(20)
+    assert metrics.counter("test_events_total", "Test events", kind="test") is counter
+
+    text = metrics.render()
+    assert '# TYPE test_events_total counter\ntest_events_total{kind="test"} 3\n' in text
+    assert 'test_latency_seconds_bucket{le="0.0005"} 1\n' in text
+    assert 'test_latency_seconds_bucket{le="+Inf"} 2\ntest_latency_seconds_sum 20.0003\n' in text
+    assert "test_latency_seconds: count 2, avg 10000.150 ms, max 20000.000 ms" in metrics.summary()
+
+
+def test_async_log_handler_sampling():
+    stream = io.StringIO()
+    handler = log_handlers.AsyncStreamHandler(stream, sample_rate=0.5)
+    handler.setFormatter(log_handlers.JsonFormatter())
+    for i in range(4):
+        handler.handle(logging.makeLogRecord({"name": log_handlers.MESSAGES_LOGGER, "msg": "message {}".format(i)}))
+    handler.handle(logging.makeLogRecord({"name": "chat_logger", "msg": "Server started", "levelname": "INFO"}))
+    handler.close()     # queued records are written before closing
+
+    entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [entry["message"] for entry in entries] == ["message 1", "message 3", "Server started"]
+    assert entries[-1]["logger"] == "chat_logger" and entries[-1]["level"] == "INFO"
+
+
+def test_slack_user_name_cache(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(slack_state.time, "monotonic", lambda: now[0])
+    cache = slack_state.UserNameCache(size=2, ttl=60)
+    cache.put("U1", "Alice")
+    cache.put("U2", "Bob")
+    assert cache.get("U1") == "Alice"   # U2 becomes the least recently used name
+    cache.put("U3", "Carl")
+    assert cache.get("U2") is None and cache.get("U3") == "Carl"
+
+    now[0] += 61    # names are expired
+    assert cache.get("U1") is None
+    assert cache.stats() == {"size": 1, "hits": 2, "misses": 2}
+
+    assert slack_state.display_name({"id": "U1", "name": "alice", "real_name": "Alice"}) == "Alice"
+    assert slack_state.display_name({"id": "U1", "name": "alice", "real_name": ""}) == "alice"
+    assert slack_state.display_name({"id": "U1"}) == "U1"
+
+
+def test_slack_inbound_queue():
+    queue = slack_state.InboundQueue(size=2, policy="drop_oldest")
+    for msg in ("first", "second", "third"):
+        queue.put(msg)
+    assert queue.take_all(0) == ["second", "third"] and queue.dropped == 1
+
+    queue = slack_state.InboundQueue(size=2, policy="drop_newest")
+    for msg in ("first", "second", "third"):
+        queue.put(msg)
+    assert queue.take_all(0) == ["first", "second"] and queue.dropped == 1
+    assert not queue.take_all(0)
+
+    # long polling: take_all waits until message is put by another thread
+    timer = threading.Timer(0.1, queue.put, ["late"])
+    timer.start()
+    started = time.monotonic()
+    assert queue.take_all(5) == ["late"] and time.monotonic() - started < 1
+    timer.join()
+    assert not queue.take_all(0.1) and time.monotonic() - started >= 0.2
@@ -4,6 +4,7 @@ Unit tests
 # pylint: disable=C0116     # docstrings
 # pylint: disable=C0103     # UPPER_CASE naming style
 # pylint: disable=W0603     # global statement
+import asyncio
 import os
 import sys
 import time
@@ -12,6 +13,9 @@ import subprocess
 import threading
 from typing import Tuple
 import logging.config
+import pytest
+import chat_client
+import common
 
 server_process = None
 client_process = None
@@ -261,7 +265,12 @@ def test_server_commands_help():
                     "[server] participants-count - return count of chat participants",
                     "[server] rock-paper-scissors - play rock-paper-scissors game with server",
                     "[server] 21 - play 21 game with server",
-                    "[server] quiz - quiz game for all participants"]
+                    "[server] quiz [category] - quiz game for all participants of the room",
+                    "[server] history [N] - return the last N public messages",
+                    "[server] search <text> - return the last public messages with text",
+                    "[server] rooms - return list of rooms with count of their members",
+                    "[server] join <room> - leave the current room and join another one",
+                    "[server] stats - return server metrics"]
 
     server_process, server_stdout_queue = start_server()
     client1_process, client1_stdout_queue = start_client(username1)
@@ -316,3 +325,174 @@ def test_server_commands_participants():
 
     write_stdin(client3_process, "")
     assert wait_line_from_stdout(client3_stdout_queue, 1) is None
+
+
+def test_server_commands_history():
+    # [server] history
+    global server_process
+    global client1_process
+    global client2_process
+    username1 = "Test User1"
+    username2 = "Test User2"
+    message1 = "test_msg1"
+    message2 = "test_msg2"
+
+    server_process, server_stdout_queue = start_server()
+    client1_process, _ = start_client(username1)
+    assert "Accepted new connection from" in wait_line_from_stdout(server_stdout_queue)
+
+    write_stdin(client1_process, message1)
+    assert wait_line_from_stdout(server_stdout_queue) == "[{}] {}".format(username1, message1)
+    write_stdin(client1_process, message2)
+    assert wait_line_from_stdout(server_stdout_queue) == "[{}] {}".format(username1, message2)
+
+    # the last messages are sent after registration
+    client2_process, client2_stdout_queue = start_client(username2)
+    assert wait_line_from_stdout(client2_stdout_queue) == "[{}] {}".format(username1, message1)
+    assert wait_line_from_stdout(client2_stdout_queue) == "[{}] {}".format(username1, message2)
+
+    write_stdin(client2_process, "[server] history 1")
+    assert wait_line_from_stdout(client2_stdout_queue) == "[server] -> [{}] The last 1 message(s):".format(username2)
+    assert wait_line_from_stdout(client2_stdout_queue) == "[{}] {}".format(username1, message2)
+
+
+def test_server_commands_rooms():
+    # [server] join <room>
+    # [server] rooms
+    global server_process
+    global client1_process
+    global client2_process
+    username1 = "Test User1"
+    username2 = "Test User2"
+
+    server_process, _ = start_server()
+    client1_process, client1_stdout_queue = start_client(username1)
+    client2_process, client2_stdout_queue = start_client(username2)
+    assert "Accepted new connection from" in wait_line_from_stdout(client1_stdout_queue)
+
+    write_stdin(client1_process, "[server] join dev")
+    assert wait_line_from_stdout(client2_stdout_queue) == "User '{}' left the room".format(username1)
+    assert wait_line_from_stdout(client1_stdout_queue) == "[server] -> [{}] You joined room 'dev'".format(username1)
+
+    # public messages are sent only to members of sender's room
+    write_stdin(client2_process, "test_msg")
+    assert wait_line_from_stdout(client1_stdout_queue, 2) is None
+
+    write_stdin(client2_process, "[server] rooms")
+    assert wait_line_from_stdout(client2_stdout_queue) == "[server] -> [{}] List of rooms: main (1), dev (1)"\
+        .format(username2)
+
+
+def test_quiz_in_room():
+    # [server] quiz
+    global server_process
+    global client1_process
+    global client2_process
+    username1 = "Test User1"
+    username2 = "Test User2"
+
+    server_process, server_stdout_queue = start_server()
+    client1_process, client1_stdout_queue = start_client(username1)
+    client2_process, _ = start_client(username2)
+    assert "Accepted new connection from" in wait_line_from_stdout(client1_stdout_queue)
+    write_stdin(client1_process, "[server] join dev")
+    assert wait_line_from_stdout(client1_stdout_queue) == "[server] -> [{}] You joined room 'dev'".format(username1)
+
+    write_stdin(client1_process, "[server] quiz")
+    assert wait_line_from_stdout(client1_stdout_queue) == "Let's start Quiz round!"
+    write_stdin(client1_process, "[server] quiz")
+    assert wait_line_from_stdout(client1_stdout_queue, 3) == "You have 30 sec and you can send several answers"
+    wait_line_from_stdout(client1_stdout_queue)     # question
+    assert wait_line_from_stdout(client1_stdout_queue) == "[server] -> [{}] Quiz is already running in this room"\
+        .format(username1)
+
+    # quiz in room 'dev' does not capture messages of other rooms
+    write_stdin(client2_process, "hello")
+    line = wait_line_from_stdout(server_stdout_queue)
+    while line is not None and line != "[{}] hello".format(username2):
+        line = wait_line_from_stdout(server_stdout_queue)
+    assert line is not None
+
+    write_stdin(client2_process, "[server] join dev")
+    assert wait_line_from_stdout(client1_stdout_queue) == "User '{}' joined the room".format(username2)
+    write_stdin(client2_process, "answer")
+    assert wait_line_from_stdout(client1_stdout_queue, 2) is None   # answers are not broadcast
+
+
+def test_client_library():
+    global server_process
+    server_process, _ = start_server()
+
+    async def scenario():
+        clients = [await chat_client.connect("localhost") for _ in range(3)]
+        assert await clients[0].register("Test User1") and await clients[1].register("Test User2")
+        assert not await clients[2].register("test user1")
+        assert await clients[2].register("Test User3")
+
+        await clients[0].send("Hello")
+        assert (await clients[1].receive()).endswith("username: Test User3")
+        assert await clients[1].receive() == "[Test User1] Hello"
+        await clients[1].send_private("Test User3", "secret")
+        await clients[2].command("participants-count")
+        messages = [await clients[2].receive() for _ in range(2)]
+        assert messages == ["[Test User1] Hello", "[Test User2] -> [Test User3] secret"]
+        assert await clients[2].receive() == "[server] -> [Test User3] Participants count: 3"
+        for client in clients:
+            await client.close()
+
+    asyncio.run(asyncio.wait_for(scenario(), 10))
+
+
+def test_client_resume():
+    global server_process
+    server_process, _ = start_server()
+
+    async def scenario():
+        reader = await chat_client.connect("localhost")
+        writer = await chat_client.connect("localhost")
+        await reader.send("/resume nosuch x Test User1")     # malformed request is not registered as username
+        await reader.receive()  # greeting
+        assert (await reader.receive()).startswith("Name '/resume nosuch x Test User1' is not available")
+        assert await reader.register("Test User1") and await writer.register("Test User2")
+        await writer.send("first")
+        assert (await reader.receive()).endswith("username: Test User2")
+        assert await reader.receive() == "[Test User2] first" and reader.seq == 1
+
+        await reader.close()    # connection is lost
+        await writer.receive()  # Test User1 was disconnected
+        await writer.send("second")
+        await writer.send("third")
+        await writer.send_private("server", "participants-count")
+        assert await writer.receive() == "[server] -> [Test User2] Participants count: 1"
+
+        assert await reader.reconnect()
+        assert [await reader.receive() for _ in range(2)] == ["[Test User2] second", "[Test User2] third"]
+        assert reader.seq == 3
+        for client in (reader, writer):
+            await client.close()
+
+    asyncio.run(asyncio.wait_for(scenario(), 10))
+
+
+def test_message_near_size_limit():
+    global server_process
+    server_process, _ = start_server()
+
+    async def scenario():
+        sender = await chat_client.connect("localhost")
+        receiver = await chat_client.connect("localhost")
+        assert await sender.register("Test User1") and await receiver.register("Test User2")
+        message = "x" * common.MAX_CLIENT_MESSAGE_SIZE
+        await sender.send(message)
+        # server adds sender name and sequence number, frame still fits into limit of receiver
+        assert await receiver.receive() == "[Test User1] " + message and receiver.seq == 1
+        with pytest.raises(ValueError):
+            await sender.send(message + "x")
+
+        late = await chat_client.connect("localhost")
+        assert await late.register("Test User3")   # message is sent from history with sequence number too
+        assert await late.receive() == "[Test User1] " + message
+        for client in (sender, receiver, late):
+            await client.close()
+
+    asyncio.run(asyncio.wait_for(scenario(), 10))
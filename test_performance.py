@@ -2,18 +2,40 @@
 Checking performance
 """
 # pylint: disable=C0116     # docstrings
+import argparse
+import asyncio
+import benchmark
 import server
 import common
+import metrics
 
 
 def test_create_server_socket():
-    with common.Timer("create_server_socket"):
+    with metrics.Timer(metrics.histogram("chat_create_server_socket_seconds", "Duration of create_server_socket")):
         common.create_server_socket()
 
 
 def test_split_message():
-    @common.timer
+    @metrics.timer
     def split_message(msg):
         return server.split_message(msg)
 
     assert split_message("[server] rock-paper-scissors") == ("server", "rock-paper-scissors")
+
+
+def test_load_scenarios():
+    # small run of benchmark.py, full load: python benchmark.py --json results.json
+    process = benchmark.start_server("server.py", benchmark.PORT)
+    try:
+        load = argparse.Namespace(idle=100, clients=20, senders=3, messages=10)
+        results = asyncio.run(benchmark.run_benchmark(benchmark.PORT, process.pid, load))
+        assert process.poll() is None
+    finally:
+        process.terminate()
+        process.wait()
+
+    assert results["connect"]["idle_connections"] == 100
+    assert results["registration"]["count"] == 20
+    assert results["broadcast"]["count"] == 30 and results["private"]["count"] == 30
+    assert results["games"]["count"] == 3
+    assert 0 < results["broadcast"]["p50_ms"] <= results["broadcast"]["p99_ms"]